@@ -0,0 +1,137 @@
+import tensorflow as tf
+import threading
+import json
+import os
+
+
+class Checkpoint_Manager:
+    """
+    Saves and restores the variables of a network with savers that are built once.
+    Periodic checkpoints are written in a background thread from an in-graph snapshot of the variables,
+    such that training continues while the files are written.
+    """
+
+    def __init__(self, session, model_dir, keep_last=3, save_every=None, snapshot=True):
+        """
+        :param session: The session of the network. The graph has to be built already.
+        :param model_dir: The model directory in which the checkpoints are stored
+        :param keep_last: Number of periodic checkpoints that are kept. The best checkpoint is always kept.
+        :param save_every: If specified, maybe_save writes a periodic checkpoint every save_every training steps
+        :param snapshot: If True, snapshot variables are built such that periodic checkpoints can be written asynchronously
+        """
+        self.session = session
+        self.model_dir = model_dir
+        self.save_every = save_every
+        self.thread = None
+        self.error = None
+
+        variables = tf.compat.v1.global_variables()
+        self.saver = tf.compat.v1.train.Saver(variables)
+
+        if snapshot:
+            # copies of the variables, which are not part of the global variables and therefore never trained or saved directly
+            self.snapshots = [tf.compat.v1.Variable(tf.zeros(v.shape, dtype=v.dtype.base_dtype), trainable=False, collections=['snapshots'])
+                              for v in variables]
+            self.snapshot_op = tf.group(*[s.assign(v) for s, v in zip(self.snapshots, variables)])
+            self.session.run(tf.compat.v1.variables_initializer(self.snapshots))
+
+            # the snapshot savers store the copies under the names of the original variables
+            var_list = {v.op.name: s for v, s in zip(variables, self.snapshots)}
+            self.step_saver = tf.compat.v1.train.Saver(var_list, max_to_keep=keep_last)
+            self.best_saver = tf.compat.v1.train.Saver(var_list, max_to_keep=None)
+
+            # continue the retention of an earlier run
+            state = tf.compat.v1.train.get_checkpoint_state(model_dir, 'checkpoint_steps')
+            if state is not None:
+                self.step_saver.recover_last_checkpoints(list(state.all_model_checkpoint_paths))
+        else:
+            self.snapshot_op = None
+
+    def save(self, name='best'):
+        """
+        Synchronously saves the current variables as a named checkpoint
+        :param name: Name of the checkpoint
+        """
+        path = os.path.join(self.model_dir, f'model_{name}.ckpt')
+        path = self.saver.save(self.session, path)
+        print(f'Model saved in file: {path}')
+
+    def restore(self, name='best'):
+        """
+        Restores the variables from a named checkpoint
+        :param name: Name of the checkpoint
+        """
+        self.saver.restore(self.session, os.path.join(self.model_dir, f'model_{name}.ckpt'))
+
+    def save_step(self, step, epoch, metric=None, best=False):
+        """
+        Writes a periodic checkpoint in the background. Only the snapshot of the variables blocks the caller.
+        :param step: The global step, which is part of the file name
+        :param epoch: The epoch from which training continues when it is resumed from this checkpoint
+        :param metric: Optional value of the metric that selects the best checkpoint
+        :param best: If True, the snapshot is also written as the best checkpoint
+        """
+        if self.snapshot_op is None:
+            raise RuntimeError('Periodic checkpoints require snapshot variables')
+
+        # the snapshot variables may only be overwritten once the previous write is complete
+        self.wait()
+        self.session.run(self.snapshot_op)
+
+        def write():
+            try:
+                path = self.step_saver.save(self.session, os.path.join(self.model_dir, 'model_step.ckpt'), global_step=step,
+                                            latest_filename='checkpoint_steps', write_meta_graph=False)
+                if best:
+                    self.best_saver.save(self.session, os.path.join(self.model_dir, 'model_best.ckpt'))
+                    print(f'Model saved in file: {os.path.join(self.model_dir, "model_best.ckpt")}')
+
+                # stored last, such that the state always refers to a complete checkpoint
+                state = self.read_state() or {}
+                state.update({'checkpoint': os.path.basename(path), 'global_step': int(step), 'epoch': int(epoch)})
+                if best:
+                    state['best_metric'] = None if metric is None else float(metric)
+                with open(os.path.join(self.model_dir, 'training_state.json'), 'w') as f:
+                    json.dump(state, f)
+            except Exception as e:
+                self.error = e
+
+        self.thread = threading.Thread(target=write)
+        self.thread.start()
+
+    def maybe_save(self, step, epoch):
+        """
+        Writes a periodic checkpoint if step is a multiple of save_every.
+        A checkpoint within an epoch restarts that epoch from its weights when training is resumed, since the order of the batches
+        in an epoch is drawn anew and can not be reproduced.
+        """
+        if self.save_every is not None and step % self.save_every == 0:
+            self.save_step(step, epoch)
+
+    def wait(self):
+        """ Blocks until the pending background write is complete and raises its error, if any """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def read_state(self):
+        path = os.path.join(self.model_dir, 'training_state.json')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def restore_latest(self):
+        """
+        Restores the variables and the global step from the latest periodic checkpoint
+        :return: A dict with the 'epoch' to continue with, the 'global_step' and the 'best_metric', or None if there is no checkpoint
+        """
+        state = self.read_state()
+        if state is None or 'checkpoint' not in state:
+            return None
+        self.saver.restore(self.session, os.path.join(self.model_dir, state['checkpoint']))
+        print(f'Resuming from {state["checkpoint"]} with epoch {state["epoch"]}')
+        return state
@@ -0,0 +1,58 @@
+from model import RUN_CSP
+from numpy_model import NumPy_RUN_CSP
+from csp_utils import CSP_Instance
+
+import argparse
+import sys
+import numpy as np
+
+
+def compare(model_dir, n_variables=100, n_clauses=400, iterations=30, n_instances=5, tolerance=1e-3):
+    """
+    Checks that NumPy_RUN_CSP computes the same predictions as the tensorflow network for the same initial states
+    :param model_dir: The model directory of a trained network
+    :param n_variables: Number of variables of each random instance
+    :param n_clauses: Number of clauses of each random instance
+    :param iterations: Number of iterations of both networks
+    :param n_instances: Number of random instances
+    :param tolerance: Maximum absolute difference of the soft assignments
+    :return: True if all soft assignments are within the tolerance and all hard assignments agree
+    """
+    network = RUN_CSP.load(model_dir)
+    numpy_network = NumPy_RUN_CSP.load(model_dir)
+
+    success = True
+    for i in range(n_instances):
+        instance = CSP_Instance.generate_random(n_variables, n_clauses, network.language)
+        initial_states = numpy_network.get_initial_state(instance.n_variables)
+
+        output = network.predict(instance, iterations, initial_states=initial_states)
+        numpy_output = numpy_network.predict(instance, iterations, initial_states=initial_states)
+
+        difference = np.max(np.abs(output['phi'] - numpy_output['phi']))
+        agreement = np.mean(output['assignment'] == numpy_output['assignment'])
+        print(f'Instance {i}: max difference of phi {difference:.2e}, agreement of assignments {100 * agreement:.2f}%, '
+              f'conflicts {output["conflicts"]} (tensorflow) and {numpy_output["conflicts"]} (numpy)')
+        success = success and difference <= tolerance and agreement == 1.0
+
+    return success
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--model_dir', type=str, help='The model directory of a trained network, i.e. models/3COL_Pos_1')
+    parser.add_argument('-v', '--n_variables', type=int, default=100, help='Number of variables in each random instance.')
+    parser.add_argument('-c', '--n_clauses', type=int, default=400, help='Number of clauses in each random instance.')
+    parser.add_argument('-t', '--t_max', type=int, default=30, help='Number of iterations t_max of both networks')
+    parser.add_argument('-i', '--n_instances', type=int, default=5, help='Number of random instances.')
+    parser.add_argument('--tolerance', type=float, default=1e-3, help='Maximum absolute difference of the soft assignments.')
+    args = parser.parse_args()
+
+    if not compare(args.model_dir, args.n_variables, args.n_clauses, args.t_max, args.n_instances, args.tolerance):
+        print('The NumPy network does not match the tensorflow network')
+        sys.exit(1)
+    print('The NumPy network matches the tensorflow network')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+from csp_utils import Constraint_Language, is_language
+
+import data_utils
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--data_path', type=str, help='Path to a directory or tar archive with graphs in dimacs format or formulas in dimacs cnf format.')
+    parser.add_argument('--members', type=str, nargs='*', default=None, help='Patterns of the files to load from the data path or archive. Loads all files by default.')
+    parser.add_argument('-o', '--out_path', type=str, help='Directory in which the binary instance cache is stored.')
+    parser.add_argument('-p', '--problem', type=str, choices=['coloring', 'max_cut', 'max_is', 'max_2sat'], help='The problem that determines the constraint language.')
+    parser.add_argument('--n_colors', type=int, default=3, help='Number of colors. Only used for coloring.')
+    parser.add_argument('--weighted', action='store_true', help='Load weighted formulas from .wcnf files. Only used for max_2sat.')
+    parser.add_argument('--load_workers', type=int, default=None, help='Number of worker processes that parse the data files in parallel.')
+    args = parser.parse_args()
+
+    print('loading instances...')
+    if args.problem == 'coloring':
+        instances = data_utils.load_graph_instances(args.data_path, Constraint_Language.get_coloring_language(args.n_colors), 'NEQ', patterns=args.members, n_workers=args.load_workers)
+    elif args.problem == 'max_cut':
+        instances = data_utils.load_graph_instances(args.data_path, Constraint_Language.get_coloring_language(2), 'NEQ', patterns=args.members, n_workers=args.load_workers)
+    elif args.problem == 'max_is':
+        instances = data_utils.load_graph_instances(args.data_path, is_language, 'NAND', patterns=args.members, n_workers=args.load_workers)
+    else:
+        instances = data_utils.load_formula_instances(args.data_path, weighted=args.weighted, patterns=args.members, n_workers=args.load_workers)
+
+    print(f'writing {len(instances)} instances to {args.out_path}')
+    data_utils.write_instance_cache(args.out_path, instances)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
 import numpy as np
 import networkx as nx
 import json
-import itertools
+import collections
+import threading
+import weakref
 
 from tqdm import tqdm
 
@@ -71,53 +73,129 @@ mc_weighted_language = Constraint_Language(domain_size=2,
 
 
 class CSP_Instance:
-    """ A class to represent a CSP instance """
+    """
+    A class to represent a CSP instance.
+    All clauses are stored in one (m, 2) int32 array of endpoints, which is sorted by relation.
+    The clauses of the k-th relation of the language are edges[relation_offsets[k]:relation_offsets[k+1]].
+    """
 
-    def __init__(self, language, n_variables, clauses, clause_weights=None, name=None):
+    def __init__(self, language, n_variables, clauses, clause_weights=None, name=None, degrees=None):
         """
         :param language: A Constraint_Language object
         :param n_variables: The number of variables
         :param clauses: A dict specifying the clauses for each relation in the language.
                         I.E {'XOR': [[1,2], [5,4], [3,1]], 'AND': [[1,4], [2,5]]}
+        :param degrees: Optional precomputed degree of each variable. Int32 arrays are used without copying.
         """
+        # assure clauses are in numpy format, missing relations have no clauses
+        blocks = [np.int32(clauses.get(r, [])).reshape([-1, 2]) for r in language.relation_names]
+        edges = np.concatenate(blocks)
+        relation_offsets = np.cumsum([0] + [len(b) for b in blocks])
+
+        if clause_weights is not None:
+            weights = np.concatenate([np.float32(clause_weights.get(r, [])).reshape([-1]) for r in language.relation_names])
+        else:
+            weights = None
+
+        self.set_arrays(language, n_variables, edges, relation_offsets, weights, name, degrees)
+
+    def set_arrays(self, language, n_variables, edges, relation_offsets, weights=None, name=None, degrees=None):
         self.language = language
         self.n_variables = n_variables
-        # assure clauses are un numpy format
-        self.clauses = {r: np.int32(c) for r, c in clauses.items()}
+        self.edges = np.int32(edges).reshape([-1, 2])
+        self.relation_offsets = np.int64(relation_offsets)
+        self.weights = np.float32(weights) if weights is not None else None
         self.name = name
-        
-        if clause_weights is not None:
-            self.weighted = True
-            self.clause_weights = {r: np.float32(w) for r, w in clause_weights.items()}
-        else:
-            self.weighted = False
+        self.n_clauses = len(self.edges)
 
-        # compute number of clauses and degree of each variable
-        all_clauses = list(itertools.chain.from_iterable(clauses.values()))
-        variables, counts = np.unique(all_clauses, return_counts=True)
-        degrees = np.zeros(shape=(n_variables), dtype=np.int32)
-        for u, c in zip(variables, counts):
-            degrees[u] = c
+        # compute the degree of each variable
+        if degrees is None:
+            degrees = np.bincount(self.edges.reshape([-1]), minlength=n_variables)
+        self.degrees = np.int32(degrees)
+
+    @staticmethod
+    def from_arrays(language, n_variables, edges, relation_offsets, weights=None, name=None, degrees=None):
+        """
+        Creates an instance without copying int32 edges, float32 weights and int32 degrees
+        :param language: A Constraint_Language object
+        :param n_variables: The number of variables
+        :param edges: An int array of shape (m, 2) with the endpoints of all clauses, sorted by relation
+        :param relation_offsets: An array of length len(language.relation_names) + 1 with the start of each relation in edges
+        :param weights: Optional array with the weight of each clause
+        :return: A CSP instance
+        """
+        instance = CSP_Instance.__new__(CSP_Instance)
+        instance.set_arrays(language, n_variables, edges, relation_offsets, weights, name, degrees)
+        return instance
 
-        self.degrees = degrees
-        self.n_clauses = len(all_clauses)
+    @property
+    def weighted(self):
+        return self.weights is not None
+
+    @property
+    def clauses(self):
+        """ A dict with a view on the clauses of each relation """
+        o = self.relation_offsets
+        return {r: self.edges[o[k]:o[k + 1]] for k, r in enumerate(self.language.relation_names)}
+
+    @property
+    def clause_weights(self):
+        """ A dict with a view on the clause weights of each relation, or None if the instance is unweighted """
+        if self.weights is None:
+            return None
+        o = self.relation_offsets
+        return {r: self.weights[o[k]:o[k + 1]] for k, r in enumerate(self.language.relation_names)}
+
+    @property
+    def relation_ids(self):
+        """ The index of the relation of each clause as an uint8 array """
+        return np.repeat(np.arange(len(self.language.relation_names), dtype=np.uint8), np.diff(self.relation_offsets))
 
     def count_conflicts(self, assignment):
         """
         :param assignment: A hard variable assignment represented as a list of ints of length n_variables.
         :return: The number of unsatisfied clauses in this instances
         """
-        conflicts = 0
-        matrices = self.language.relation_matrices
-        for r, M in matrices.items():
-            valid = np.float32([M[assignment[u], assignment[v]] for [u, v] in self.clauses[r]])
-            has_conflict = 1.0 - valid
-            if self.weighted:
-                has_conflict = has_conflict * self.clause_weights[r]
+        conflicts, weighted_conflicts = self.score_assignments(np.int32(assignment))
+        return int(weighted_conflicts if self.weighted else conflicts)
 
-            conflicts += np.sum(has_conflict)
-
-        return int(conflicts)
+    def score_assignments(self, assignments, max_elements=2 ** 24):
+        """
+        Counts the conflicts of many assignments at once with vectorized lookups in the relation matrices
+        :param assignments: Hard assignments as an int array of shape (attempts, n_variables, iterations).
+                            Arrays of shape (n_variables, iterations) and (n_variables,) are also accepted.
+        :param max_elements: Upper bound on the size of the intermediate (attempts, clauses, iterations) arrays
+        :return: The number of conflicts and the weighted number of conflicts of each assignment.
+                 Both arrays have the shape of assignments without the variable axis.
+                 The weighted conflicts equal the conflicts if the instance is unweighted.
+        """
+        assignments = np.asarray(assignments)
+        shape = assignments.shape
+        if assignments.ndim == 1:
+            assignments = assignments.reshape([1, -1, 1])
+        elif assignments.ndim == 2:
+            assignments = assignments[np.newaxis]
+        attempts, _, iterations = assignments.shape
+
+        conflicts = np.zeros([attempts, iterations], dtype=np.int64)
+        weighted_conflicts = np.zeros([attempts, iterations], dtype=np.float64)
+        chunk = max(1, max_elements // (attempts * iterations))
+        clause_weights = self.clause_weights
+        for r, M in self.language.relation_matrices.items():
+            clauses = self.clauses[r]
+            is_conflict = M == 0.0
+            for start in range(0, len(clauses), chunk):
+                c = clauses[start:start + chunk]
+                conf = is_conflict[assignments[:, c[:, 0], :], assignments[:, c[:, 1], :]]
+                conflicts += np.sum(conf, axis=1)
+                if self.weighted:
+                    weighted_conflicts += np.einsum('amt,m->at', conf, clause_weights[r][start:start + chunk])
+
+        if not self.weighted:
+            weighted_conflicts = np.float64(conflicts)
+
+        out_shape = shape[:-2] + shape[-1:] if len(shape) > 1 else ()
+        return conflicts.reshape(out_shape), weighted_conflicts.reshape(out_shape)
 
     @staticmethod
     def merge(instances):
@@ -127,25 +205,40 @@ class CSP_Instance:
         :return: CSP instances that contains all given instances with shifted variables
         """
         language = instances[0].language
+        n_relations = len(language.relation_names)
+        shifts = np.cumsum([0] + [instance.n_variables for instance in instances])
 
-        clauses = {r: [] for r in language.relation_names}
-        n_variables = 0
+        # the degrees are unchanged, only the endpoints are shifted
+        edges = np.concatenate([instance.edges[instance.relation_offsets[k]:instance.relation_offsets[k + 1]] + np.int32(shift)
+                                for k in range(n_relations) for instance, shift in zip(instances, shifts)])
+        relation_offsets = np.sum([instance.relation_offsets for instance in instances], axis=0)
+        degrees = np.concatenate([instance.degrees for instance in instances])
 
-        for instance in instances:
-            for r in language.relation_names:
-                shifted = instance.clauses[r] + n_variables
-                clauses[r].append(shifted)
-            n_variables += instance.n_variables
+        if instances[0].weighted:
+            weights = np.concatenate([instance.weights[instance.relation_offsets[k]:instance.relation_offsets[k + 1]]
+                                      for k in range(n_relations) for instance in instances])
+        else:
+            weights = None
 
-        clauses = {r: np.vstack(c) for r, c in clauses.items()}
+        return CSP_Instance.from_arrays(language, int(shifts[-1]), edges, relation_offsets, weights, degrees=degrees)
 
-        if instances[0].weighted:
-            weights = {r: np.hstack([x.clause_weights[r] for x in instances]) for r in language.relation_names}
+    def replicate(self, copies):
+        """
+        Merges multiple copies of this instance with broadcasting. This is equivalent to merge([self] * copies).
+        :param copies: The number of copies
+        :return: A CSP instance that contains 'copies' many copies of this instance with shifted variables
+        """
+        o = self.relation_offsets
+        shifts = (np.arange(copies, dtype=np.int32) * self.n_variables).reshape([-1, 1, 1])
+        edges = np.concatenate([(self.edges[o[k]:o[k + 1]] + shifts).reshape([-1, 2]) for k in range(len(o) - 1)])
+        degrees = np.tile(self.degrees, copies)
+
+        if self.weighted:
+            weights = np.concatenate([np.tile(self.weights[o[k]:o[k + 1]], copies) for k in range(len(o) - 1)])
         else:
             weights = None
 
-        merged_instance = CSP_Instance(language, n_variables, clauses, weights)
-        return merged_instance
+        return CSP_Instance.from_arrays(self.language, copies * self.n_variables, edges, copies * o, weights, degrees=degrees)
 
     @staticmethod
     def batch_instances(instances, batch_size):
@@ -168,6 +261,30 @@ class CSP_Instance:
 
         return batches
 
+    @staticmethod
+    def pack_instances(instances, copies=1, max_clauses=None, max_variables=None):
+        """
+        Static method to group consecutive instances such that their merged copies stay within a size budget
+        :param instances: A list or iterator of CSP instances
+        :param copies: The number of copies of each instance that will be merged
+        :param max_clauses: Maximum number of clauses in each merged group. Unbounded if None.
+        :param max_variables: Maximum number of variables in each merged group. Unbounded if None.
+        :return: A generator of lists of instances. Each group contains at least one instance, even if it exceeds the budget.
+        """
+        group, n_clauses, n_variables = [], 0, 0
+        for instance in instances:
+            n_clauses += copies * instance.n_clauses
+            n_variables += copies * instance.n_variables
+            too_large = (max_clauses is not None and n_clauses > max_clauses) or \
+                        (max_variables is not None and n_variables > max_variables)
+            if too_large and len(group) > 0:
+                yield group
+                group, n_clauses, n_variables = [], copies * instance.n_clauses, copies * instance.n_variables
+            group.append(instance)
+
+        if len(group) > 0:
+            yield group
+
     @staticmethod
     def generate_random(n_variables, n_clauses, language, weighted=False):
         """
@@ -176,22 +293,39 @@ class CSP_Instance:
         :param language: A Constraint Language
         :return: A random CSP Instance with the specified parameters. Clauses are sampled uniformly.
         """
-        variables = list(range(n_variables))
-        clauses = {r: [] for r in language.relation_names}
-        relations = np.random.choice(language.relation_names, n_clauses)
+        return CSP_Instance.generate_random_batch(n_variables, [n_clauses], language, weighted=weighted)
 
-        for i in range(n_clauses):
-            clause = list(np.random.choice(variables, 2, replace=False))
-            r = relations[i]
-            clauses[r].append(clause)
+    @staticmethod
+    def generate_random_batch(n_variables, clause_counts, language, weighted=False):
+        """
+        Samples multiple random instances at once and returns them merged into one instance
+        :param n_variables: Number of variables in each instance
+        :param clause_counts: A list with the number of clauses of each instance
+        :param language: A Constraint Language
+        :return: A CSP instance that contains len(clause_counts) random instances with shifted variables.
+                 Clauses have two distinct endpoints and a uniformly chosen relation.
+        """
+        clause_counts = np.int64(clause_counts)
+        n_clauses = int(np.sum(clause_counts))
 
-        if weighted:
-            clause_weights = {r: np.random.uniform(size=[len(clauses[r])]) for r in language.relation_names}
-            # clause_weights = {r: np.ones([len(clauses[r])]) for r in language.relation_names}
-        else:
-            clause_weights = None
-            
-        instance = CSP_Instance(language, n_variables, clauses, clause_weights)
+        # sample the second endpoint from the remaining variables to obtain distinct endpoints
+        left = np.random.randint(n_variables, size=n_clauses)
+        right = np.random.randint(n_variables - 1, size=n_clauses)
+        right += right >= left
+
+        # shift the variables of each instance
+        offsets = np.repeat(np.arange(len(clause_counts)) * n_variables, clause_counts)
+        edges = np.int32(np.stack([left, right], axis=1) + offsets.reshape([-1, 1]))
+
+        # sort the clauses by their uniformly chosen relation
+        n_relations = len(language.relation_names)
+        relations = np.random.randint(n_relations, size=n_clauses)
+        edges = edges[np.argsort(relations, kind='stable')]
+        relation_offsets = np.cumsum([0] + list(np.bincount(relations, minlength=n_relations)))
+
+        weights = np.random.uniform(size=[n_clauses]) if weighted else None
+
+        instance = CSP_Instance.from_arrays(language, len(clause_counts) * n_variables, edges, relation_offsets, weights)
         return instance
 
     @staticmethod
@@ -228,10 +362,76 @@ class CSP_Instance:
         return instance
 
     @staticmethod
-    def cnf_to_instance(formula, clause_weights=None):
+    def edges_to_csp_instance(n_variables, edges, language, relation_name, name=None):
+        """
+        :param n_variables: The number of nodes of the graph
+        :param edges: An int array of shape (m, 2) with the 0-based edges of the graph
+        :param language: A Constraint Language
+        :param relation_name: The relation name to assign to each edge
+        :return: A CSP Instance representing the graph
+        """
+        # all clauses belong to one relation
+        k = language.relation_names.index(relation_name)
+        relation_offsets = [0] * (k + 1) + [len(edges)] * (len(language.relation_names) - k)
+
+        instance = CSP_Instance.from_arrays(language, n_variables, edges, relation_offsets, name=name)
+        return instance
+
+    @staticmethod
+    def edges_to_weighted_mc_instance(n_variables, edges, weights=None, name=None):
+        """
+        :param n_variables: The number of nodes of the graph
+        :param edges: An int array of shape (m, 2) with the 0-based edges of the graph
+        :param weights: An array with the weight of each edge. Positive edges should be cut, negative edges should not.
+                        All edges are positive if None.
+        :return: A CSP Instance over mc_weighted_language representing the graph
+        """
+        positive = np.asarray(weights) > 0 if weights is not None else np.ones(len(edges), dtype=bool)
+        clauses = {'EQ': np.int32(edges[~positive]), 'NEQ': np.int32(edges[positive])}
+
+        instance = CSP_Instance(mc_weighted_language, n_variables, clauses, name=name)
+        return instance
+
+    @staticmethod
+    def cnf_arrays_to_instance(literals, clause_weights=None, name=None):
+        """
+        Vectorized version of cnf_to_instance
+        :param literals: An int array of shape (m, 2) with the signed literals of each clause of a 2-cnf formula.
+                         Clauses with a single literal l are given as [l, l].
+        :param clause_weights: Optional array with the weight of each clause
+        :param name: Optional name of the instance
+        :return: A CSP instance that represents the formula
+        """
+        literals = np.asarray(literals)
+        positive = literals > 0
+
+        # implications are normalized such that the negative literal comes first
+        is_impl = positive[:, 0] != positive[:, 1]
+        swap = is_impl & positive[:, 0]
+        literals = np.where(swap.reshape([-1, 1]), literals[:, ::-1], literals)
+
+        types = {'OR': positive[:, 0] & positive[:, 1], 'IMPL': is_impl, 'NAND': ~positive[:, 0] & ~positive[:, 1]}
+        variables = np.int32(np.abs(literals) - 1)
+        clauses = {t: variables[mask] for t, mask in types.items()}
+
+        if clause_weights is not None:
+            clause_weights = np.asarray(clause_weights)
+            weights = {t: clause_weights[mask] for t, mask in types.items()}
+        else:
+            weights = None
+
+        n_variables = int(np.max(np.abs(literals))) if len(literals) > 0 else 0
+
+        instance = CSP_Instance(max_2sat_language, n_variables, clauses, clause_weights=weights, name=name)
+        return instance
+
+    @staticmethod
+    def cnf_to_instance(formula, clause_weights=None, name=None):
         """
         :param formula: A 2-cnf formula represented as a list of lists of ints.
                         I.e. ((X1 or X2) and (not X2 or X3)) is [[1, 2], [-2, 3]]
+        :param clause_weights: Optional list with the weight of each clause
+        :param name: Optional name of the instance
         :return: A CSP instance that represents the formula
         """
 
@@ -272,5 +472,96 @@ class CSP_Instance:
 
         n_variables = np.max([np.max(np.abs(clause)) for clause in formula])
 
-        instance = CSP_Instance(max_2sat_language, n_variables, clauses, clause_weights=weights)
+        instance = CSP_Instance(max_2sat_language, n_variables, clauses, clause_weights=weights, name=name)
         return instance
+
+
+def get_nbytes(value):
+    """ Estimates the memory of arrays, sparse matrices and CSP instances, also inside of dicts, lists and tuples """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(get_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(get_nbytes(v) for v in value)
+    if isinstance(value, CSP_Instance):
+        return get_nbytes([value.edges, value.weights, value.degrees])
+    if hasattr(value, 'indptr'):
+        # compressed sparse matrices
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    return 0
+
+
+class Instance_Cache:
+    """
+    A least recently used cache for data that is derived from CSP instances, i.e. replicated instances and feed dicts.
+    Entries are keyed by the identity of the instance and an additional key. They do not keep the instance alive
+    and are dropped as soon as the instance is garbage collected.
+    The cache is disabled by default, since it only helps workloads that query the same instance repeatedly.
+    """
+
+    def __init__(self, max_bytes=2 ** 28, max_entries=0):
+        """
+        :param max_bytes: Upper bound on the memory of all cached values, as estimated by get_nbytes. Larger values are not cached.
+        :param max_entries: Maximum number of cached values. The cache is disabled if this is 0.
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # entries are also removed by weakref callbacks, which may run in any thread
+        self.lock = threading.RLock()
+
+    def get(self, instance, key, build):
+        """
+        :param instance: A CSP instance
+        :param key: A hashable key for the derived data, i.e. the number of attempts
+        :param build: A function without arguments that computes the value if it is not cached
+        :return: The cached or newly built value
+        """
+        if self.max_entries <= 0:
+            return build()
+
+        k = (id(instance), key)
+        with self.lock:
+            entry = self.entries.get(k)
+            if entry is not None and entry[0]() is instance:
+                self.entries.move_to_end(k)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = build()
+        n_bytes = get_nbytes(value)
+        if n_bytes > self.max_bytes:
+            return value
+
+        with self.lock:
+            self.discard(k)
+            ref = weakref.ref(instance, lambda r, k=k: self.discard(k, r))
+            self.entries[k] = (ref, value, n_bytes)
+            self.n_bytes += n_bytes
+
+            # evict the least recently used entries
+            while self.n_bytes > self.max_bytes or len(self.entries) > self.max_entries:
+                _, (_, _, size) = self.entries.popitem(last=False)
+                self.n_bytes -= size
+        return value
+
+    def discard(self, k, ref=None):
+        """ Removes the entry with key k. If ref is given, the entry is only removed if it still belongs to this reference. """
+        with self.lock:
+            entry = self.entries.get(k)
+            if entry is not None and (ref is None or entry[0] is ref):
+                del self.entries[k]
+                self.n_bytes -= entry[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.n_bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
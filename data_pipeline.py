@@ -0,0 +1,118 @@
+import multiprocessing as mp
+import numpy as np
+import collections
+
+from csp_utils import CSP_Instance
+
+
+def random_batch(seed, language, n_variables, c_min, c_max, batch_size):
+    """
+    Samples a batch of random instances as in train.py
+    :param seed: Seed for the random number generator of this batch
+    :param language: A Constraint Language
+    :param n_variables: Number of variables in each instance
+    :param c_min: Minimum number of clauses in each instance
+    :param c_max: Maximum number of clauses in each instance
+    :param batch_size: Number of instances in the batch
+    :return: A CSP instance that consists of 'batch_size' many merged random instances
+    """
+    np.random.seed(seed)
+    return CSP_Instance.generate_random_batch(n_variables, np.random.randint(c_min, c_max, size=batch_size), language)
+
+
+class Batch_Stream:
+    """ Produces training batches in background worker processes while the network trains on the current batch """
+
+    def __init__(self, make_batch, n_batches=None, n_workers=2, prefetch=8, seed=None):
+        """
+        :param make_batch: A picklable function that maps a seed to a batch, i.e. a functools.partial of random_batch
+        :param n_batches: Number of batches in each epoch. The stream is infinite if None.
+        :param n_workers: Number of worker processes
+        :param prefetch: Maximum number of batches that are produced ahead of the trainer
+        :param seed: Seed from which the seeds of all batches are derived
+        """
+        self.make_batch = make_batch
+        self.n_batches = n_batches
+        self.prefetch = prefetch
+        self.seeds = np.random.SeedSequence(seed)
+
+        # tensorflow sessions are not fork safe
+        self.pool = mp.get_context('spawn').Pool(n_workers)
+        self.pending = collections.deque()
+
+    def __len__(self):
+        return self.n_batches
+
+    def submit(self):
+        seed = int(self.seeds.spawn(1)[0].generate_state(1)[0])
+        self.pending.append(self.pool.apply_async(self.make_batch, (seed,)))
+
+    def __iter__(self):
+        """ Iterates over one epoch. Batches for the next epoch are already prefetched at the end of the current one """
+        i = 0
+        while self.n_batches is None or i < self.n_batches:
+            while len(self.pending) < self.prefetch:
+                self.submit()
+            yield self.pending.popleft().get()
+            i += 1
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+class Bucket_Batches:
+    """
+    Training batches that are packed up to a budget of clauses and variables instead of a fixed number of instances.
+    The instances are sorted by their number of clauses and split into buckets of similar size, such that the batches
+    of each bucket fill the budget evenly. The batches are drawn anew from shuffled buckets in each epoch,
+    so the number of batches, i.e. len(), can change from one epoch to the next.
+    """
+
+    def __init__(self, instances, max_clauses=None, max_variables=None, n_buckets=8, seed=None):
+        """
+        :param instances: A list of CSP instances
+        :param max_clauses: Maximum number of clauses in each batch. Unbounded if None.
+        :param max_variables: Maximum number of variables in each batch. Unbounded if None.
+        :param n_buckets: Number of buckets of instances with similar numbers of clauses
+        :param seed: Seed for shuffling the buckets and batches
+        """
+        self.instances = sorted(instances, key=lambda instance: instance.n_clauses)
+        self.max_clauses = max_clauses
+        self.max_variables = max_variables
+        # an empty list of instances still has one (empty) bucket, which yields no batches
+        self.n_buckets = max(1, min(n_buckets, len(self.instances)))
+        self.rng = np.random.RandomState(seed)
+        self.groups = self.plan()
+
+    def plan(self):
+        """ :return: A shuffled list with the instances of each batch of the next epoch """
+        groups = []
+        for bucket in np.array_split(np.arange(len(self.instances)), self.n_buckets):
+            bucket = [self.instances[i] for i in self.rng.permutation(bucket)]
+            groups += CSP_Instance.pack_instances(bucket, max_clauses=self.max_clauses, max_variables=self.max_variables)
+        self.rng.shuffle(groups)
+        return groups
+
+    def __len__(self):
+        """ :return: The number of batches of the next epoch """
+        return len(self.groups)
+
+    def __iter__(self):
+        """ Iterates over one epoch and merges each batch when it is needed """
+        for group in self.groups:
+            yield CSP_Instance.merge(group)
+        self.groups = self.plan()
+
+
+def training_batches(instances, batch_size, max_clauses=None, max_variables=None):
+    """
+    :param instances: A list of CSP instances
+    :param batch_size: Number of instances in each batch, only used if there is no budget
+    :param max_clauses: Optional budget of clauses in each batch
+    :param max_variables: Optional budget of variables in each batch
+    :return: Bucket_Batches if a budget is given and fixed size batches of CSP_Instance.batch_instances otherwise
+    """
+    if max_clauses is None and max_variables is None:
+        return CSP_Instance.batch_instances(instances, batch_size)
+    return Bucket_Batches(instances, max_clauses, max_variables)
@@ -1,14 +1,213 @@
 import numpy as np
 import networkx as nx
 import os
-import glob
+import io
+import re
+import json
+import tarfile
+import gzip
+import bz2
+import lzma
+import functools
+import multiprocessing as mp
 from tqdm import tqdm
 
+from csp_utils import Constraint_Language, CSP_Instance, max_2sat_language
+
+
+# number of bytes of lines that are tokenized at once by the array loaders
+CHUNK_SIZE = 2 ** 24
+
+# decompressors for single compressed files
+DECOMPRESSORS = {'.gz': lambda f: gzip.GzipFile(fileobj=f), '.bz2': bz2.BZ2File, '.xz': lzma.LZMAFile}
+
+ARCHIVE_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# default file patterns of the dataset loaders, compressed files are matched as well
+GRAPH_PATTERNS = ['*.dimacs'] + [f'*.dimacs{e}' for e in DECOMPRESSORS]
+
+
+def formula_patterns(weighted):
+    extension = 'wcnf' if weighted else 'cnf'
+    return [f'**/*.{extension}'] + [f'**/*.{extension}{e}' for e in DECOMPRESSORS]
+
+
+def open_data_file(path, fileobj=None):
+    """
+    Opens a data file for binary reading and transparently decompresses .gz, .bz2 and .xz files
+    :param path: The path or name of the file. Its extension determines the compression.
+    :param fileobj: Optional file object to read from instead of opening path, i.e. a member of a tar archive
+    :return: A binary file object
+    """
+    if fileobj is None:
+        fileobj = open(path, 'rb')
+    extension = os.path.splitext(path)[1]
+    if extension in DECOMPRESSORS:
+        return DECOMPRESSORS[extension](fileobj)
+    return fileobj
+
+
+def as_data_file(path):
+    """ Returns path if it already is a file object and opens it with open_data_file otherwise """
+    if isinstance(path, (str, os.PathLike)):
+        return open_data_file(path)
+    return path
+
+
+def is_archive(path):
+    return str(path).endswith(ARCHIVE_EXTENSIONS)
+
+
+def iterate_data_files(path, patterns):
+    """
+    Iterates over the data files that match any of the given patterns in the order of their paths, without extracting archives to disk.
+    An archive is treated like the directory it extracts to, i.e. the patterns are matched relative to its single top level directory.
+    :param path: A directory or a tar archive (optionally compressed with gzip, bzip2 or xz)
+    :param patterns: A list of glob patterns relative to path, where '**' matches any number of directories
+    :return: A generator of (name, binary file object) tuples. Each file object is only valid until the next item.
+    """
+    if is_archive(path):
+        yield from iterate_archive_files(path, patterns)
+    else:
+        for p in data_file_paths(path, patterns):
+            with open_data_file(p) as f:
+                yield p, f
+
+
+def iterate_archive_files(path, patterns):
+    """
+    Streams the matching members of an archive in the order of their names.
+    The archive is read twice: once to list the members and once to decompress them. Members that are stored
+    before a member with a smaller name are kept in memory until it is their turn.
+    """
+    with tarfile.open(path, 'r|*') as archive:
+        names = [member.name for member in archive if member.isfile()]
+    names = sorted(set(match_files(names, patterns, archive_root(names))))
+
+    position = 0
+    remaining = set(names)
+    pending = {}
+    with tarfile.open(path, 'r|*') as archive:
+        for member in archive:
+            if position == len(names):
+                break
+            if member.name in remaining and member.isfile():
+                remaining.remove(member.name)
+                if member.name != names[position]:
+                    pending[member.name] = archive.extractfile(member).read()
+                    continue
+                with open_data_file(member.name, archive.extractfile(member)) as f:
+                    yield member.name, f
+                position += 1
+
+            # yield the buffered members that are next in order
+            while position < len(names) and names[position] in pending:
+                with open_data_file(names[position], io.BytesIO(pending.pop(names[position]))) as f:
+                    yield names[position], f
+                position += 1
+
+
+def archive_root(names):
+    """ :return: The top level directory of the archive with the given member names, including its '/', or '' if there are several """
+    roots = set(name.split('/', 1)[0] + '/' if '/' in name else '' for name in names)
+    return roots.pop() if len(roots) == 1 else ''
+
+
+def match_files(names, patterns, root=''):
+    """
+    :param names: Paths of files, which start with root
+    :param patterns: Glob patterns relative to root, where '*' does not match '/' and '**/' matches any number of directories
+    :return: The names that match any of the patterns
+    """
+    expressions = [re.compile(translate_pattern(p)) for p in patterns]
+    return [name for name in names if any(e.match(name[len(root):]) for e in expressions)]
+
+
+def translate_pattern(pattern):
+    """ Translates a glob pattern with the semantics of glob.glob(pattern, recursive=True) into a regular expression """
+    expression = ''
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            expression += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            expression += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            expression += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            expression += '[^/]'
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            # character class, where a leading '!' negates it
+            end = pattern.index(']', i + 2)
+            content = pattern[i + 1:end]
+            expression += '[' + ('^' + content[1:] if content.startswith('!') else content).replace('\\', '\\\\') + ']'
+            i = end + 1
+        else:
+            expression += re.escape(pattern[i])
+            i += 1
+    return '(?s:' + expression + r')\Z'
+
+
+def data_file_paths(path, patterns):
+    """ The sorted paths of all files in the directory path that match any of the given patterns """
+    paths = [os.path.join(directory, f) for directory, _, files in os.walk(path) for f in files]
+    return sorted(match_files(paths, patterns, os.path.join(path, '')))
+
+
+def load_data_files_parallel(path, patterns, parse_file, n_workers, chunksize=None):
+    """
+    Parses data files in a pool of worker processes
+    :param path: A directory or a tar archive
+    :param patterns: A list of file or archive member patterns
+    :param parse_file: A picklable function that maps a path (or archive member name) and a binary file object to a result
+    :param n_workers: Number of worker processes
+    :param chunksize: Number of files that are sent to a worker at once. By default, each worker receives about 4 chunks.
+    :return: A list of the results, sorted by the paths of the files
+    """
+    if is_archive(path):
+        # the archive is decompressed sequentially, the workers only receive the bytes of each member
+        tasks = sorted((p, f.read()) for p, f in iterate_data_files(path, patterns))
+    else:
+        # workers open the files themselves
+        tasks = [(p, None) for p in data_file_paths(path, patterns)]
+
+    if chunksize is None:
+        chunksize = max(1, len(tasks) // (4 * n_workers))
+
+    # spawn instead of fork, since the calling script may already hold a tensorflow session
+    with mp.get_context('spawn').Pool(n_workers) as pool:
+        return list(tqdm(pool.imap(functools.partial(parse_data_file, parse_file), tasks, chunksize), total=len(tasks)))
+
+
+def parse_data_file(parse_file, task):
+    p, data = task
+    if data is None:
+        with open_data_file(p) as f:
+            return parse_file(p, f)
+    return parse_file(p, io.BytesIO(data))
+
+
+def data_file_name(path):
+    """ The base name of a data file without the extension of its compression """
+    name = os.path.basename(path)
+    root, extension = os.path.splitext(name)
+    return root if extension in DECOMPRESSORS else name
+
 
 def load_dimacs_graph(path):
-    f = open(path, 'r')
+    """
+    Loads a graph in dimacs format
+    :param path: The path to a (possibly compressed) .dimacs file or a binary file object
+    :return: A NetworkX graph
+    """
+    f = as_data_file(path)
     g = nx.Graph()
     for line in f:
+        line = line.decode()
         s = line.split()
         if s[0] == 'p':
             g.add_nodes_from(range(int(s[2])))
@@ -22,6 +221,90 @@ def load_dimacs_graph(path):
     return g
 
 
+def load_dimacs_graph_arrays(path):
+    """
+    Loads a graph in dimacs format without networkx
+    :param path: The path to a (possibly compressed) .dimacs file or a binary file object
+    :return: The number of nodes, an int32 array of shape (m, 2) with the 0-based edges and an int32 array
+             with the edge weights (None if the edges are unweighted). Like a networkx graph, each undirected edge
+             is contained once and the last weight of repeated edges is kept.
+    """
+    n_nodes = 0
+    n_columns = None
+    chunks = []
+    with as_data_file(path) as f:
+        while True:
+            lines = f.readlines(CHUNK_SIZE)
+            if not lines:
+                break
+            edge_lines = []
+            for line in lines:
+                if line.startswith(b'e'):
+                    edge_lines.append(line[1:])
+                elif line.startswith(b'p'):
+                    n_nodes = int(line.split()[2])
+            if len(edge_lines) == 0:
+                continue
+            if n_columns is None:
+                n_columns = len(edge_lines[0].split())
+
+            # tokenize all edge lines of the chunk at once
+            values = np.fromstring(b' '.join(edge_lines), dtype=np.int64, sep=' ')
+            if values.size != n_columns * len(edge_lines):
+                raise ValueError(f'Inconsistent edge lines in {path}')
+            chunks.append(values.reshape([-1, n_columns]))
+
+    if len(chunks) == 0:
+        return n_nodes, np.zeros([0, 2], dtype=np.int32), None
+
+    values = np.concatenate(chunks, axis=0)
+    edges = np.sort(values[:, :2] - 1, axis=1)
+
+    # remove repeated edges, keeping the last occurrence
+    _, idx = np.unique(edges[::-1], axis=0, return_index=True)
+    idx = np.sort(len(edges) - 1 - idx)
+    edges = np.int32(edges[idx])
+    weights = np.int32(values[idx, 2]) if n_columns > 2 else None
+
+    n_nodes = max(n_nodes, int(np.max(edges)) + 1 if len(edges) > 0 else 0)
+    return n_nodes, edges, weights
+
+
+def iterate_graph_instances(path, language, relation_name, patterns=None):
+    """
+    Lazily loads the graphs in dimacs format under path as CSP instances. Only one file is parsed at a time.
+    :param path: The directory or tar archive in which to look for .dimacs files, or an instance cache written by write_instance_cache
+    :param language: A Constraint Language
+    :param relation_name: The relation name to assign to each edge
+    :param patterns: Optional list of file or archive member patterns. Defaults to all (compressed) .dimacs files.
+    :return: A generator of CSP instances named after their files
+    """
+    if is_instance_cache(path):
+        yield from iterate_instance_cache(path, language)
+        return
+
+    for p, f in iterate_data_files(path, patterns or GRAPH_PATTERNS):
+        n_nodes, edges, _ = load_dimacs_graph_arrays(f)
+        yield CSP_Instance.edges_to_csp_instance(n_nodes, edges, language, relation_name, name=data_file_name(p))
+
+
+def parse_graph_instance(language, relation_name, p, f):
+    n_nodes, edges, _ = load_dimacs_graph_arrays(f)
+    return CSP_Instance.edges_to_csp_instance(n_nodes, edges, language, relation_name, name=data_file_name(p))
+
+
+def load_graph_instances(path, language, relation_name, patterns=None, n_workers=None):
+    """
+    Loads all graphs in dimacs format under path as a list of CSP instances, see iterate_graph_instances
+    :param n_workers: If specified, the files are parsed and converted by this many worker processes.
+                      The instances are then sorted by path.
+    """
+    if n_workers is None or is_instance_cache(path):
+        return list(tqdm(iterate_graph_instances(path, language, relation_name, patterns)))
+    parse_file = functools.partial(parse_graph_instance, language, relation_name)
+    return load_data_files_parallel(path, patterns or GRAPH_PATTERNS, parse_file, n_workers)
+
+
 def write_dimacs_graph(graph, path):
     f = open(path, 'w')
     
@@ -33,31 +316,44 @@ def write_dimacs_graph(graph, path):
     f.close()
 
 
-def load_graphs(path):
+def iterate_graphs(path, patterns=None):
+    """
+    Lazily loads the graphs from all '.dimacs' files
+    :param path: The directory or tar archive in which to look for .dimacs files
+    :param patterns: Optional list of file or archive member patterns. Defaults to all (compressed) .dimacs files.
+    :return: A generator of (name, NetworkX graph) tuples
+    """
+    for p, f in iterate_data_files(path, patterns or GRAPH_PATTERNS):
+        yield data_file_name(p), load_dimacs_graph(f)
+
+
+def load_graphs(path, patterns=None):
     """
-    Loads the graphs from all '.adj' files in NetworkX adjacency list format
-    :param path: The pattern under which to look for .adj files
-    :return: A list of NetworkX graphs
+    Loads the graphs from all '.dimacs' files
+    :param path: The directory or tar archive in which to look for .dimacs files
+    :param patterns: Optional list of file or archive member patterns. Defaults to all (compressed) .dimacs files.
+    :return: A list of names and a list of NetworkX graphs
     """
-    paths = glob.glob(os.path.join(path, '*.dimacs'), recursive=True)
-    graphs = [load_dimacs_graph(p) for p in tqdm(paths)]
-    names = [os.path.basename(p) for p in paths]
+    names, graphs = [], []
+    for name, g in tqdm(iterate_graphs(path, patterns)):
+        names.append(name)
+        graphs.append(g)
     return names, graphs
 
 
 def load_dimacs_cnf(path, weighted=False):
     """
     Loads a cnf formula from a file in dimacs cnf format
-    :param path: the path to a .cnf file in dimacs format
+    :param path: the path to a (possibly compressed) .cnf file in dimacs format or a binary file object
     :return: The formula as a list of lists of signed integers. 
              I.E. ((X1 or X2) and (not X2 or X3)) is [[1, 2], [-2, 3]]
     """
-    file = open(path, 'r')
+    file = as_data_file(path)
     f = []
     if weighted:
         weights = []
     for line in file:
-        s = line.split()
+        s = line.decode().split()
         if not s[0] == 'c' and not s[0] == 'p':
             assert(s[-1] == '0')
             if weighted:
@@ -74,6 +370,75 @@ def load_dimacs_cnf(path, weighted=False):
         return f
 
 
+def load_dimacs_cnf_arrays(path, weighted=False):
+    """
+    Loads a 2-cnf formula in dimacs (w)cnf format without building python lists
+    :param path: The path to a (possibly compressed) .cnf or .wcnf file in dimacs format or a binary file object
+    :param weighted: Whether the first number of each clause is its weight
+    :return: An int32 array of shape (m, 2) with the signed literals of each clause and an array with the clause weights
+             (None if weighted is False). Clauses with a single literal l are stored as [l, l].
+    """
+    chunks = []
+    with as_data_file(path) as f:
+        while True:
+            lines = f.readlines(CHUNK_SIZE)
+            if not lines:
+                break
+            clause_lines = [line for line in lines if line.strip() and not line.startswith(b'c') and not line.startswith(b'p')]
+            chunks.append(np.fromstring(b' '.join(clause_lines), dtype=np.int64, sep=' '))
+    values = np.concatenate(chunks) if len(chunks) > 0 else np.zeros([0], dtype=np.int64)
+
+    # every clause is terminated by 0, the weight of a weighted clause is its first number
+    ends = np.flatnonzero(values == 0)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    if weighted:
+        weights = values[starts]
+        starts = starts + 1
+    else:
+        weights = None
+
+    lengths = ends - starts
+    if np.any(lengths < 1) or np.any(lengths > 2):
+        raise ValueError(f'{path} is not a 2-cnf formula')
+
+    literals = np.int32(np.stack([values[starts], values[ends - 1]], axis=1))
+    return literals, weights
+
+
+def iterate_formula_instances(path, weighted=False, patterns=None):
+    """
+    Lazily loads the 2-cnf formulas under path as CSP instances. Only one file is parsed at a time.
+    :param path: The directory or tar archive in which to look for .cnf (or .wcnf) files, or an instance cache written by write_instance_cache
+    :param weighted: Whether to load weighted formulas from .wcnf files
+    :param patterns: Optional list of file or archive member patterns. Defaults to all (compressed) .cnf or .wcnf files.
+    :return: A generator of CSP instances named after their files
+    """
+    if is_instance_cache(path):
+        yield from iterate_instance_cache(path, max_2sat_language)
+        return
+
+    for p, f in iterate_data_files(path, patterns or formula_patterns(weighted)):
+        literals, weights = load_dimacs_cnf_arrays(f, weighted)
+        yield CSP_Instance.cnf_arrays_to_instance(literals, weights, name=data_file_name(p))
+
+
+def parse_formula_instance(weighted, p, f):
+    literals, weights = load_dimacs_cnf_arrays(f, weighted)
+    return CSP_Instance.cnf_arrays_to_instance(literals, weights, name=data_file_name(p))
+
+
+def load_formula_instances(path, weighted=False, patterns=None, n_workers=None):
+    """
+    Loads all 2-cnf formulas under path as a list of CSP instances, see iterate_formula_instances
+    :param n_workers: If specified, the files are parsed and converted by this many worker processes.
+                      The instances are then sorted by path.
+    """
+    if n_workers is None or is_instance_cache(path):
+        return list(tqdm(iterate_formula_instances(path, weighted, patterns)))
+    parse_file = functools.partial(parse_formula_instance, weighted)
+    return load_data_files_parallel(path, patterns or formula_patterns(weighted), parse_file, n_workers)
+
+
 def write_dimacs_cnf(f, path):
     """
     Stores a cnf formula in the dimacs cnf format
@@ -96,10 +461,92 @@ def write_dimacs_cnf(f, path):
     return f
 
 
-def load_formulas(path, weighted=False):
-    """ Loads cnf formulas from all .cnf files found under the pattern 'path' """
-    paths = glob.glob(os.path.join(path, f'**/*.{"wcnf" if weighted else "cnf"}'), recursive=True)
-    formulas = [load_dimacs_cnf(p, weighted) for p in tqdm(paths)]
-    names = [os.path.basename(p) for p in paths]
+def iterate_formulas(path, weighted=False, patterns=None):
+    """ Lazily loads cnf formulas from all (compressed) .cnf files found under 'path' and yields (name, formula) tuples """
+    for p, f in iterate_data_files(path, patterns or formula_patterns(weighted)):
+        yield data_file_name(p), load_dimacs_cnf(f, weighted)
+
+
+def load_formulas(path, weighted=False, patterns=None):
+    """ Loads cnf formulas from all (compressed) .cnf files found under 'path', which may also be a tar archive """
+    names, formulas = [], []
+    for name, f in tqdm(iterate_formulas(path, weighted, patterns)):
+        names.append(name)
+        formulas.append(f)
     return names, formulas
 
+
+
+def is_instance_cache(path):
+    """ Checks whether path is a directory written by write_instance_cache """
+    return os.path.exists(os.path.join(path, 'cache.json'))
+
+
+def write_instance_cache(path, instances):
+    """
+    Stores CSP instances in a binary format that can be opened with memory mapping.
+    The directory contains .npy files with the concatenated clause endpoints, weights and degrees of all instances
+    and the relation offsets of each instance, as well as a json file with the names, offsets and the language.
+    :param path: The directory in which to store the cache
+    :param instances: A list of CSP instances over the same language
+    """
+    language = instances[0].language
+    weighted = instances[0].weighted
+    os.makedirs(path, exist_ok=True)
+
+    np.save(os.path.join(path, 'edges.npy'), np.concatenate([instance.edges for instance in instances]))
+    if weighted:
+        np.save(os.path.join(path, 'weights.npy'), np.concatenate([instance.weights for instance in instances]))
+    np.save(os.path.join(path, 'degrees.npy'), np.concatenate([instance.degrees for instance in instances]))
+    np.save(os.path.join(path, 'relation_offsets.npy'), np.stack([instance.relation_offsets for instance in instances]))
+
+    # offsets of each instance in the concatenated arrays
+    clause_offsets = np.cumsum([0] + [instance.n_clauses for instance in instances]).tolist()
+    variable_offsets = np.cumsum([0] + [instance.n_variables for instance in instances]).tolist()
+
+    meta = {'domain_size': language.domain_size,
+            'relations': language.relations,
+            'weighted': weighted,
+            'names': [instance.name for instance in instances],
+            'clause_offsets': clause_offsets,
+            'variable_offsets': variable_offsets}
+    with open(os.path.join(path, 'cache.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def iterate_instance_cache(path, language=None):
+    """
+    Opens an instance cache with memory mapping. The arrays of the returned instances are views of the mapped files,
+    such that multiple processes share one copy in the page cache.
+    :param path: A directory written by write_instance_cache
+    :param language: Optional Constraint Language that the cached language has to match
+    :return: A generator of CSP instances
+    """
+    with open(os.path.join(path, 'cache.json'), 'r') as f:
+        meta = json.load(f)
+
+    cached_language = Constraint_Language(meta['domain_size'], meta['relations'])
+    if language is not None:
+        if language.domain_size != cached_language.domain_size or language.relations != cached_language.relations:
+            raise ValueError(f'The instances in {path} use a different constraint language')
+    else:
+        language = cached_language
+
+    edges = np.load(os.path.join(path, 'edges.npy'), mmap_mode='r')
+    weights = np.load(os.path.join(path, 'weights.npy'), mmap_mode='r') if meta['weighted'] else None
+    degrees = np.load(os.path.join(path, 'degrees.npy'), mmap_mode='r')
+    relation_offsets = np.load(os.path.join(path, 'relation_offsets.npy'))
+
+    clause_offsets = meta['clause_offsets']
+    variable_offsets = meta['variable_offsets']
+    for i, name in enumerate(meta['names']):
+        e = edges[clause_offsets[i]:clause_offsets[i + 1]]
+        w = weights[clause_offsets[i]:clause_offsets[i + 1]] if weights is not None else None
+        d = degrees[variable_offsets[i]:variable_offsets[i + 1]]
+        n_variables = variable_offsets[i + 1] - variable_offsets[i]
+        yield CSP_Instance.from_arrays(language, n_variables, e, relation_offsets[i], w, name=name, degrees=d)
+
+
+def load_instance_cache(path, language=None):
+    """ Opens an instance cache with memory mapping and returns a list of CSP instances, see iterate_instance_cache """
+    return list(iterate_instance_cache(path, language))
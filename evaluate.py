@@ -1,5 +1,8 @@
 from model import RUN_CSP
 from csp_utils import CSP_Instance
+from parallel_evaluation import evaluate_parallel
+from pipelined_evaluation import evaluate_pipelined
+from result_writer import Result_Writer
 
 import numpy as np
 import argparse
@@ -9,20 +12,22 @@ import time
 from tqdm import tqdm
 import csv
 
-def evaluate_boosted(network, eval_instances, t_max, attempts=64):
+def evaluate_boosted(network, eval_instances, t_max, attempts=64, chunk_size=None, stop_conflicts=None):
     """
     Evaluate RUN-CSP Network with boosted predictions
     :param network: A RUN_CSP network
-    :param eval_instances: A list of CSP instances for evaluation
+    :param eval_instances: A list or iterator of CSP instances for evaluation. Each instance is released once it is scored.
     :param t_max: Number of RUN_CSP iterations on each instance
     :param attempts: Number of parallel attempts for each instance
+    :param chunk_size: Optional number of iterations per session call to bound memory for large t_max
+    :param stop_conflicts: Optional number of conflicts at which the network stops early on each instance
     """
 
     conflict_ratios = []
     for i, instance in enumerate(eval_instances):
 
         #start = time.time()
-        output_dict = network.predict_boosted(instance, iterations=t_max, attempts=attempts)
+        output_dict = network.predict_boosted(instance, iterations=t_max, attempts=attempts, chunk_size=chunk_size, stop_conflicts=stop_conflicts)
         #end = time.time()
         #print(f'Total Time: {end - start}s')
 
@@ -32,6 +37,145 @@ def evaluate_boosted(network, eval_instances, t_max, attempts=64):
         conflict_ratio = conflicts / instance.n_clauses
         conflict_ratios.append(conflict_ratio)
 
+        print(f'Conflicts for instance {i if instance.name is None else instance.name}: {conflicts}, Valid {instance.n_clauses - conflicts}, Iterations {output_dict["iterations"]}')
+
+    mean_conflict_ratio = np.mean(conflict_ratios)
+    print(f'mean conflict ratio for evaluation instances: {mean_conflict_ratio}')
+    return conflict_ratios
+
+
+def satisfied_clauses(instance, output_dict):
+    """ The default score of evaluate_and_save: The number (or weight) of clauses satisfied by the best assignment """
+    conflicts = instance.count_conflicts(output_dict['assignment'])
+    total = sum(np.sum(w) for w in instance.clause_weights.values()) if instance.weighted else instance.n_clauses
+    return total - conflicts
+
+
+def evaluate_and_save(save_path, network, eval_instances, t_max, attempts=64, chunk_size=None, stop_conflicts=None, score=satisfied_clauses):
+    """
+    Evaluate RUN-CSP Network with boosted predictions and append the result of each instance to a file as soon as it is solved.
+    Instances that are already recorded in the file are skipped, such that an interrupted evaluation can be resumed.
+    :param save_path: A .jsonl or .csv file for the results
+    :param network: A RUN_CSP network
+    :param eval_instances: A list or iterator of CSP instances for evaluation
+    :param t_max: Number of RUN_CSP iterations on each instance
+    :param attempts: Number of parallel attempts for each instance
+    :param chunk_size: Optional number of iterations per session call to bound memory for large t_max
+    :param stop_conflicts: Optional number of conflicts at which the network stops early on each instance
+    :param score: Function that maps an instance and its output dict to the score that is stored
+    :return: A list with the conflict ratios of the instances that were solved in this run
+    """
+
+    conflict_ratios = []
+    with Result_Writer(save_path) as writer:
+        for i, instance in enumerate(eval_instances):
+            name = i if instance.name is None else instance.name
+            if name in writer:
+                print(f'Skipping instance {name}, which is already recorded in {save_path}')
+                continue
+
+            start = time.time()
+            output_dict = network.predict_boosted(instance, iterations=t_max, attempts=attempts, chunk_size=chunk_size, stop_conflicts=stop_conflicts)
+            duration = time.time() - start
+
+            conflicts = instance.count_conflicts(output_dict['assignment'])
+            conflict_ratios.append(conflicts / instance.n_clauses)
+            writer.write({'name': name,
+                          'conflicts': conflicts,
+                          'score': score(instance, output_dict),
+                          'attempts': attempts,
+                          't_max': t_max,
+                          'best_iteration': output_dict['best_iteration'],
+                          'time': duration})
+
+            print(f'Conflicts for instance {name}: {conflicts}, Valid {instance.n_clauses - conflicts}, Time {duration:.2f}s')
+
+    if len(conflict_ratios) > 0:
+        print(f'mean conflict ratio for evaluation instances: {np.mean(conflict_ratios)}')
+    return conflict_ratios
+
+
+def evaluate_boosted_pipelined(network, eval_instances, t_max, attempts=64, chunk_size=None, stop_conflicts=None):
+    """
+    Evaluate RUN-CSP Network with boosted predictions, while the feed dict of the next instance is prepared
+    and the result of the previous instance is scored in background threads
+    :param network: A RUN_CSP network
+    :param eval_instances: A list or iterator of CSP instances for evaluation
+    :param t_max: Number of RUN_CSP iterations on each instance
+    :param attempts: Number of parallel attempts for each instance
+    :param chunk_size: Optional number of iterations per session call to bound memory for large t_max
+    :param stop_conflicts: Optional number of conflicts at which the network stops early on each instance
+    """
+
+    # the pipeline passes (index, instance) tuples, such that unnamed instances are reported by their index
+    def prepare(item):
+        return network.get_boosted_feed_dict(item[1], t_max, attempts)
+
+    def run(item, feed_dict):
+        return network.predict_boosted(item[1], iterations=t_max, attempts=attempts, chunk_size=chunk_size,
+                                       stop_conflicts=stop_conflicts, feed_dict=feed_dict)
+
+    def finish(item, output_dict):
+        i, instance = item
+        conflicts = instance.count_conflicts(output_dict['assignment'])
+        print(f'Conflicts for instance {i if instance.name is None else instance.name}: {conflicts}, Valid {instance.n_clauses - conflicts}, Iterations {output_dict["iterations"]}')
+        return conflicts / instance.n_clauses
+
+    conflict_ratios = evaluate_pipelined(enumerate(eval_instances), prepare, run, finish)
+
+    mean_conflict_ratio = np.mean(conflict_ratios)
+    print(f'mean conflict ratio for evaluation instances: {mean_conflict_ratio}')
+    return conflict_ratios
+
+
+def evaluate_packed(network, eval_instances, t_max, attempts=64, max_clauses=100000, max_variables=None):
+    """
+    Evaluate RUN-CSP Network with boosted predictions, where multiple instances are packed into one network pass
+    :param network: A RUN_CSP network
+    :param eval_instances: A list or iterator of CSP instances for evaluation. Each instance is released once it is scored.
+    :param t_max: Number of RUN_CSP iterations on each instance
+    :param attempts: Number of parallel attempts for each instance
+    :param max_clauses: Maximum number of clauses (including all attempts) in each pass
+    :param max_variables: Maximum number of variables (including all attempts) in each pass
+    """
+
+    conflict_ratios = []
+    i = 0
+    for group in CSP_Instance.pack_instances(eval_instances, attempts, max_clauses, max_variables):
+        output_dicts = network.predict_packed(group, iterations=t_max, attempts=attempts)
+
+        for instance, output_dict in zip(group, output_dicts):
+            conflicts = instance.count_conflicts(output_dict['assignment'])
+            conflict_ratio = conflicts / instance.n_clauses
+            conflict_ratios.append(conflict_ratio)
+
+            print(f'Conflicts for instance {i if instance.name is None else instance.name}: {conflicts}, Valid {instance.n_clauses - conflicts}')
+            i += 1
+
+    mean_conflict_ratio = np.mean(conflict_ratios)
+    print(f'mean conflict ratio for evaluation instances: {mean_conflict_ratio}')
+    return conflict_ratios
+
+
+def evaluate_boosted_parallel(network_name, model_dir, eval_instances, t_max, attempts=64, n_workers=4, threads=1):
+    """
+    Evaluate a RUN-CSP Network with boosted predictions in parallel worker processes
+    :param network_name: The name of the network class in model.py, i.e. 'RUN_CSP' or 'Max_2SAT_Network'
+    :param model_dir: The model directory of the trained network
+    :param eval_instances: A list or iterator of CSP instances for evaluation. Each instance is released once it is scored.
+    :param t_max: Number of RUN_CSP iterations on each instance
+    :param attempts: Number of parallel attempts for each instance
+    :param n_workers: Number of worker processes
+    :param threads: Number of tensorflow threads in each worker
+    """
+
+    conflict_ratios = []
+    outputs = evaluate_parallel(network_name, model_dir, eval_instances, n_workers, threads, iterations=t_max, attempts=attempts)
+    for i, (instance, output_dict) in enumerate(outputs):
+        conflicts = instance.count_conflicts(output_dict['assignment'])
+        conflict_ratio = conflicts / instance.n_clauses
+        conflict_ratios.append(conflict_ratio)
+
         print(f'Conflicts for instance {i if instance.name is None else instance.name}: {conflicts}, Valid {instance.n_clauses - conflicts}')
 
     mean_conflict_ratio = np.mean(conflict_ratios)
@@ -48,17 +192,26 @@ def main():
     parser.add_argument('-i', '--n_instances', type=int, default=100, help='Number of instances for training.')
     parser.add_argument('-t', '--t_max', type=int, default=40, help='Number of network iterations t_max')
     parser.add_argument('-a', '--attempts', type=int, default=64, help='Number of attempts to boost results')
+    parser.add_argument('--chunk_size', type=int, default=None, help='Number of iterations per session call. Bounds memory for large t_max.')
+    parser.add_argument('--stop_conflicts', type=int, default=None, help='Stop early once an attempt has at most this many conflicts.')
+    parser.add_argument('--pack_clauses', type=int, default=None, help='Pack multiple instances into one pass with at most this many clauses.')
+    parser.add_argument('--pipeline', action='store_true', help='Prepare and score instances in background threads while the network runs.')
     args = parser.parse_args()
 
     # create RUN_CSP instance for given constraint language
     network = RUN_CSP.load(args.model_dir)
     language = network.language
 
-    print(f'Generating {args.n_instances} evaluation instances')
-    eval_instances = [CSP_Instance.generate_random(args.n_variables, np.random.randint(args.c_min, args.c_max), language) for _ in tqdm(range(args.n_instances))]
+    # instances are generated lazily while the network solves the previous ones
+    eval_instances = (CSP_Instance.generate_random(args.n_variables, np.random.randint(args.c_min, args.c_max), language) for _ in range(args.n_instances))
 
     # train and store the network
-    evaluate_boosted(network, eval_instances, args.t_max, args.attempts)
+    if args.pipeline:
+        evaluate_boosted_pipelined(network, eval_instances, args.t_max, args.attempts, args.chunk_size, args.stop_conflicts)
+    elif args.pack_clauses is None:
+        evaluate_boosted(network, eval_instances, args.t_max, args.attempts, args.chunk_size, args.stop_conflicts)
+    else:
+        evaluate_packed(network, eval_instances, args.t_max, args.attempts, max_clauses=args.pack_clauses)
 
 
 if __name__ == '__main__':
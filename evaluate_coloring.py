@@ -1,5 +1,5 @@
 from model import RUN_CSP
-from evaluate import evaluate_and_save, evaluate_boosted
+from evaluate import evaluate_and_save, evaluate_boosted, evaluate_packed, evaluate_boosted_parallel, evaluate_boosted_pipelined
 from csp_utils import CSP_Instance, Constraint_Language
 
 import data_utils
@@ -16,24 +16,41 @@ def main():
     parser.add_argument('-m', '--model_dir', type=str, help='Path to the trained RUN-CSP instance')
     parser.add_argument('-t', '--t_max', type=int, default=100, help='Number of iterations t_max for which RUN-CSP runs on each instance')
     parser.add_argument('-a', '--attempts', type=int, default=64, help='Attempts for each graph')
-    parser.add_argument('-d', '--data_path', default=None, help='Path to the evaluation data. Expects a directory with graphs in dimacs format.')
+    parser.add_argument('--chunk_size', type=int, default=None, help='Number of iterations per session call. Bounds memory for large t_max.')
+    parser.add_argument('--stop_conflicts', type=int, default=None, help='Stop early once an attempt has at most this many conflicts.')
+    parser.add_argument('--pack_clauses', type=int, default=None, help='Pack multiple instances into one pass with at most this many clauses.')
+    parser.add_argument('--pipeline', action='store_true', help='Prepare and score instances in background threads while the network runs.')
+    parser.add_argument('-s', '--save_path', type=str, default=None, help='A .jsonl or .csv file to which the result of each instance is appended. Instances already in the file are skipped.')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Number of parallel worker processes that each load the network.')
+    parser.add_argument('--threads', type=int, default=1, help='Number of tensorflow threads of each worker process.')
+    parser.add_argument('-d', '--data_path', default=None, help='Path to the evaluation data. Expects a directory or a tar archive with graphs in dimacs format.')
+    parser.add_argument('--members', type=str, nargs='*', default=None, help='Patterns of the files to load from the data path or archive, i.e. "G1.dimacs". Loads all files by default.')
     parser.add_argument('-v', '--n_variables', type=int, default=400, help='Number of variables in each training instance. Only used when --data_path is not specified.')
     parser.add_argument('-c', '--n_clauses', type=int, default=1000, help='Number of clauses in each training instance. Only used when --data_path is not specified.')
     parser.add_argument('-i', '--n_instances', type=int, default=100, help='Number of instances for training. Only used when --data_path is not specified.')
     args = parser.parse_args()
 
-    network = RUN_CSP.load(args.model_dir)
-    language = network.language
+    language = Constraint_Language.load(os.path.join(args.model_dir, 'language.json'))
 
     if args.data_path is not None:
-        print('loading graphs...')
-        names, graphs = data_utils.load_graphs(args.data_path)
-        instances = [CSP_Instance.graph_to_csp_instance(g, language, 'NEQ', name=n) for n, g in zip(names, graphs)]
+        # graphs are loaded lazily while the network solves the previous ones
+        instances = data_utils.iterate_graph_instances(args.data_path, language, 'NEQ', patterns=args.members)
     else:
-        print(f'Generating {args.n_instances} training instances')
-        instances = [CSP_Instance.generate_random(args.n_variables, args.n_clauses, language) for _ in tqdm(range(args.n_instances))]
+        instances = (CSP_Instance.generate_random(args.n_variables, args.n_clauses, language) for _ in range(args.n_instances))
     
-    conflicting_edges = evaluate_boosted(network, instances, args.t_max, attempts=args.attempts)
+    if args.workers is not None:
+        conflicting_edges = evaluate_boosted_parallel('RUN_CSP', args.model_dir, instances, args.t_max, attempts=args.attempts, n_workers=args.workers, threads=args.threads)
+        return
+
+    network = RUN_CSP.load(args.model_dir)
+    if args.save_path is not None:
+        conflicting_edges = evaluate_and_save(args.save_path, network, instances, args.t_max, attempts=args.attempts, chunk_size=args.chunk_size, stop_conflicts=args.stop_conflicts)
+    elif args.pipeline:
+        conflicting_edges = evaluate_boosted_pipelined(network, instances, args.t_max, attempts=args.attempts, chunk_size=args.chunk_size, stop_conflicts=args.stop_conflicts)
+    elif args.pack_clauses is None:
+        conflicting_edges = evaluate_boosted(network, instances, args.t_max, attempts=args.attempts, chunk_size=args.chunk_size, stop_conflicts=args.stop_conflicts)
+    else:
+        conflicting_edges = evaluate_packed(network, instances, args.t_max, attempts=args.attempts, max_clauses=args.pack_clauses)
 
 if __name__ == '__main__':
     main()
@@ -1,5 +1,5 @@
 from model import Max_2SAT_Network
-from evaluate import evaluate_boosted, evaluate_and_save
+from evaluate import evaluate_boosted, evaluate_and_save, evaluate_packed, evaluate_boosted_parallel, evaluate_boosted_pipelined
 from csp_utils import CSP_Instance, max_2sat_language
 
 import data_utils
@@ -12,17 +12,34 @@ def main():
     parser.add_argument('-m', '--model_dir', type=str, help='Path to the trained RUN-CSP instance')
     parser.add_argument('-t', '--t_max', type=int, default=100, help='Number of iterations t_max for which RUN-CSP runs on each instance')
     parser.add_argument('-a', '--attempts', type=int, default=64, help='Attempts for each graph')
-    parser.add_argument('-d', '--data_path', default=None, help='Path to the evaluation data. Expects a directory with graphs in dimacs format.')
+    parser.add_argument('--chunk_size', type=int, default=None, help='Number of iterations per session call. Bounds memory for large t_max.')
+    parser.add_argument('--stop_conflicts', type=int, default=None, help='Stop early once an attempt has at most this many conflicts.')
+    parser.add_argument('--pack_clauses', type=int, default=None, help='Pack multiple instances into one pass with at most this many clauses.')
+    parser.add_argument('--pipeline', action='store_true', help='Prepare and score instances in background threads while the network runs.')
+    parser.add_argument('-s', '--save_path', type=str, default=None, help='A .jsonl or .csv file to which the result of each instance is appended. Instances already in the file are skipped.')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Number of parallel worker processes that each load the network.')
+    parser.add_argument('--threads', type=int, default=1, help='Number of tensorflow threads of each worker process.')
+    parser.add_argument('--weighted', action='store_true', help='Load weighted formulas from .wcnf files and minimize the weight of violated clauses.')
+    parser.add_argument('-d', '--data_path', default=None, help='Path to the evaluation data. Expects a directory or a tar archive with formulas in dimacs cnf format.')
+    parser.add_argument('--members', type=str, nargs='*', default=None, help='Patterns of the files to load from the data path or archive, i.e. "**/t5pm3-7777.spn.cnf". Loads all files by default.')
     args = parser.parse_args()
 
-    network = Max_2SAT_Network.load(args.model_dir)
-
-    print('loading cnf formulas...')
-    names, formulas = data_utils.load_formulas(args.data_path)
-    print('Converting formulas to CSP instances')
-    instances = [CSP_Instance.cnf_to_instance(f, name=n) for n, f in zip(names, formulas)]
+    # formulas are loaded lazily while the network solves the previous ones
+    instances = data_utils.iterate_formula_instances(args.data_path, weighted=args.weighted, patterns=args.members)
     
-    conflicting_edges = evaluate_boosted(network, instances, args.t_max, attempts=args.attempts)
+    if args.workers is not None:
+        conflicting_edges = evaluate_boosted_parallel('Max_2SAT_Network', args.model_dir, instances, args.t_max, attempts=args.attempts, n_workers=args.workers, threads=args.threads)
+        return
+
+    network = Max_2SAT_Network.load(args.model_dir)
+    if args.save_path is not None:
+        conflicting_edges = evaluate_and_save(args.save_path, network, instances, args.t_max, attempts=args.attempts, chunk_size=args.chunk_size, stop_conflicts=args.stop_conflicts)
+    elif args.pipeline:
+        conflicting_edges = evaluate_boosted_pipelined(network, instances, args.t_max, attempts=args.attempts, chunk_size=args.chunk_size, stop_conflicts=args.stop_conflicts)
+    elif args.pack_clauses is None:
+        conflicting_edges = evaluate_boosted(network, instances, args.t_max, attempts=args.attempts, chunk_size=args.chunk_size, stop_conflicts=args.stop_conflicts)
+    else:
+        conflicting_edges = evaluate_packed(network, instances, args.t_max, attempts=args.attempts, max_clauses=args.pack_clauses)
 
 
 if __name__ == '__main__':
@@ -23,9 +23,10 @@ def evaluate_boosted(network, instances, degree, t_max, attempts=64):
     mean_Ps = []
 
     for i, instance in enumerate(instances):
-        output_dict = network.predict_boosted(instance, iterations=t_max, attempts=attempts)
+        output_dict = network.predict_boosted(instance, iterations=t_max, attempts=attempts, return_all=True)
 
-        conflicts = np.int32([instance.count_conflicts(assignment) for assignment in output_dict['all_assignments'][:, :, t_max-1]])
+        conflicts, _ = instance.score_assignments(output_dict['all_assignments'][:, :, t_max-1:])
+        conflicts = np.int32(conflicts[:, 0])
         conflict_ratios = conflicts / instance.n_clauses
 
         least_conflicts = output_dict['conflicts']
@@ -49,7 +50,8 @@ def main():
     parser.add_argument('-m', '--model_dir', type=str, help='Path to the trained RUN-CSP instance')
     parser.add_argument('-t', '--t_max', type=int, default=100, help='Number of iterations t_max for which RUN-CSP runs on each instance')
     parser.add_argument('-a', '--attempts', type=int, default=64, help='Attempts for each graph')
-    parser.add_argument('-d', '--data_path', default=None, help='Path to the evaluation data. Expects a directory with graphs in dimacs format.')
+    parser.add_argument('-d', '--data_path', default=None, help='Path to the evaluation data. Expects a directory or a tar archive with graphs in dimacs format.')
+    parser.add_argument('--members', type=str, nargs='*', default=None, help='Patterns of the files to load from the data path or archive, i.e. "G1.dimacs". Loads all files by default.')
     parser.add_argument('-v', '--n_variables', type=int, default=100, help='Number of variables in each training instance. Only used when --data_path is not specified.')
     parser.add_argument('--degree', type=int, default=3, help='The uniform degree of the regular graphs.')
     parser.add_argument('-i', '--n_instances', type=int, default=1000, help='Number of instances for training. Only used when --data_path is not specified.')
@@ -58,14 +60,12 @@ def main():
     language = Constraint_Language.get_coloring_language(2)
     network = RUN_CSP.load(args.model_dir)
 
+    # instances are loaded or generated lazily while the network solves the previous ones
     if args.data_path is not None:
-        print('loading graphs...')
-        names, graphs = data_utils.load_graphs(args.data_path)
-        instances = [CSP_Instance.graph_to_csp_instance(g, language, 'NEQ') for g in graphs]
+        instances = data_utils.iterate_graph_instances(args.data_path, language, 'NEQ', patterns=args.members)
     else:
-        print(f'Generating {args.n_instances} training instances')
-        graphs = [nx.random_regular_graph(args.degree, args.n_variables) for _ in range(args.n_instances)]
-        instances = [CSP_Instance.graph_to_csp_instance(g, language, 'NEQ') for g in graphs]
+        graphs = (nx.random_regular_graph(args.degree, args.n_variables) for _ in range(args.n_instances))
+        instances = (CSP_Instance.graph_to_csp_instance(g, language, 'NEQ') for g in graphs)
 
     evaluate_boosted(network, instances, args.degree, args.t_max, args.attempts)
 
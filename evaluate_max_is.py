@@ -1,5 +1,6 @@
 from model import Max_IS_Network
 from csp_utils import CSP_Instance, is_language
+from parallel_evaluation import evaluate_parallel
 
 import data_utils
 import argparse
@@ -14,18 +15,37 @@ def evaluate_boosted(network, eval_instances, t_max, attempts=64):
     """
     Evaluate Independent Set Network with boosted predictions
     :param network: A Max_IS_Network
-    :param eval_instances: A list of CSP instances for evaluation
+    :param eval_instances: A list or iterator of CSP instances for evaluation
     :param t_max: Number of RUN_CSP iterations on each instance
     :param attempts: Number of parallel attempts for each instance
     """
+    outputs = (network.predict_boosted_and_corrected(instance, iterations=t_max, attempts=attempts) for instance in eval_instances)
+    print_results(outputs)
 
-    conflict_ratios = []
-    is_sizes = []
-    for i, instance in enumerate(eval_instances):
 
-        # get boosted and corrected predictions
-        output_dict = network.predict_boosted_and_corrected(instance, iterations=t_max, attempts=attempts)
+def evaluate_boosted_parallel(model_dir, eval_instances, t_max, attempts=64, n_workers=4, threads=1):
+    """
+    Evaluate Independent Set Network with boosted predictions in parallel worker processes
+    :param model_dir: The model directory of the trained Max_IS_Network
+    :param eval_instances: A list or iterator of CSP instances for evaluation
+    :param t_max: Number of RUN_CSP iterations on each instance
+    :param attempts: Number of parallel attempts for each instance
+    :param n_workers: Number of worker processes
+    :param threads: Number of tensorflow threads of each worker process
+    """
+    outputs = evaluate_parallel('Max_IS_Network', model_dir, eval_instances, n_workers, threads,
+                                method='predict_boosted_and_corrected', iterations=t_max, attempts=attempts)
+    print_results(output_dict for _, output_dict in outputs)
+
 
+def print_results(outputs):
+    """
+    Prints the results of each instance and their mean
+    :param outputs: An iterator of output dicts of predict_boosted_and_corrected
+    """
+    conflict_ratios = []
+    is_sizes = []
+    for i, output_dict in enumerate(outputs):
         conflicts = output_dict['conflicts']
         conflict_ratio = output_dict['conflict_ratio']
         conflict_ratios.append(conflict_ratio)
@@ -43,16 +63,20 @@ def main():
     parser.add_argument('-m', '--model_dir', type=str, help='Path to the trained RUN-CSP instance')
     parser.add_argument('-t', '--t_max', type=int, default=100, help='Number of iterations t_max for which RUN-CSP runs on each instance')
     parser.add_argument('-a', '--attempts', type=int, default=64, help='Attempts for each graph')
-    parser.add_argument('-d', '--data_path', default=None, help='Path to the evaluation data. Expects a directory with graphs in dimacs format.')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Number of parallel worker processes that each load the network.')
+    parser.add_argument('--threads', type=int, default=1, help='Number of tensorflow threads of each worker process.')
+    parser.add_argument('-d', '--data_path', default=None, help='Path to the evaluation data. Expects a directory or a tar archive with graphs in dimacs format.')
+    parser.add_argument('--members', type=str, nargs='*', default=None, help='Patterns of the files to load from the data path or archive, i.e. "G1.dimacs". Loads all files by default.')
     args = parser.parse_args()
 
-    network = Max_IS_Network.load(args.model_dir)
-
-    print('loading graphs...')
-    names, graphs = data_utils.load_graphs(args.data_path)
-    instances = [CSP_Instance.graph_to_csp_instance(g, is_language, 'NAND') for n, g in zip(names, graphs)]
+    # graphs are loaded lazily while the network solves the previous ones
+    instances = data_utils.iterate_graph_instances(args.data_path, is_language, 'NAND', patterns=args.members)
     
-    evaluate_boosted(network, instances, args.t_max, attempts=args.attempts)
+    if args.workers is not None:
+        evaluate_boosted_parallel(args.model_dir, instances, args.t_max, attempts=args.attempts, n_workers=args.workers, threads=args.threads)
+    else:
+        network = Max_IS_Network.load(args.model_dir)
+        evaluate_boosted(network, instances, args.t_max, attempts=args.attempts)
     
 if __name__ == '__main__':
     main()
@@ -13,11 +13,15 @@ import csv
 from tqdm import tqdm
 
 
-def compute_weighted_score(instance, assignment):
-    matrices = mc_weighted_language.relation_matrices
-    valid_pos = np.float32([matrices['NEQ'][assignment[u], assignment[v]] for [u, v] in instance.clauses['NEQ']])
-    valid_neg = np.float32([matrices['NEQ'][assignment[u], assignment[v]] for [u, v] in instance.clauses['EQ']])
-    score = np.sum(valid_pos) - np.sum(valid_neg)
+def compute_weighted_score(instance, assignments):
+    """
+    :param instance: A CSP instance over mc_weighted_language
+    :param assignments: Hard assignments with any shape accepted by CSP_Instance.score_assignments
+    :return: Number of cut positive edges minus the number of cut negative edges for each assignment
+    """
+    # positive edges are cut unless they conflict, negative edges are cut exactly when they conflict
+    conflicts, _ = instance.score_assignments(assignments)
+    score = len(instance.clauses['NEQ']) - conflicts
     return score
 
 
@@ -33,12 +37,12 @@ def evaluate_boosted(network, eval_instances, t_max, attempts=64):
     conflict_ratios = []
     for i, instance in enumerate(eval_instances):
         # start = time.time()
-        output_dict = network.predict_boosted(instance, iterations=t_max, attempts=attempts)
+        output_dict = network.predict_boosted(instance, iterations=t_max, attempts=attempts, return_all=True)
         # end = time.time()
         # print(f'Total Time: {end - start}s')
 
         all_assignment = output_dict['all_assignments']
-        best_per_attempt = [np.max([compute_weighted_score(instance, all_assignment[a, :, t]) for t in range(t_max)]) for a in range(attempts)]
+        best_per_attempt = np.max(compute_weighted_score(instance, all_assignment), axis=1)
 
         best = np.max(best_per_attempt)
         mean = np.mean(best_per_attempt)
@@ -65,16 +69,15 @@ def main():
                         help='Number of clauses in each training instance. Only used when --data_path is not specified.')
     parser.add_argument('-i', '--n_instances', type=int, default=100,
                         help='Number of instances for training. Only used when --data_path is not specified.')
-    parser.add_argument('-s', '--save_path', type=str, help='Path to a csv file to store results')
+    parser.add_argument('-s', '--save_path', type=str, help='A .jsonl or .csv file to which the result of each instance is appended. Instances already in the file are skipped.')
     args = parser.parse_args()
 
     language = mc_weighted_language
 
     if args.data_path is not None:
-        print('loading graphs...')
-        graphs = [data_utils.load_col_graph(p) for p in tqdm(glob.glob(args.data_path))]
-        names = [os.path.basename(p) for p in glob.glob(args.data_path)]
-        instances = [CSP_Instance.graph_to_weighted_mc_instance(g, name=name) for g, name in zip(graphs, names)]
+        # graphs are loaded lazily while the network solves the previous ones
+        instances = (CSP_Instance.edges_to_weighted_mc_instance(*data_utils.load_dimacs_graph_arrays(p), name=os.path.basename(p))
+                     for p in glob.glob(args.data_path))
     else:
         print(f'Generating {args.n_instances} training instances')
         # instances = [CSP_Instance.generate_random(args.n_variables, args.n_clauses, language) for _ in tqdm(range(args.n_instances))]
@@ -86,7 +89,8 @@ def main():
     if args.save_path is None:
         conflicting_edges = evaluate_boosted(net, instances, args.t_max, attempts=args.attempts)
     else:
-        conflicting_edges = evaluate_and_save(args.save_path, net, instances, args.t_max, attempts=args.attempts)
+        conflicting_edges = evaluate_and_save(args.save_path, net, instances, args.t_max, attempts=args.attempts,
+                                              score=lambda instance, output_dict: compute_weighted_score(instance, output_dict['assignment']))
 
 
 if __name__ == '__main__':
@@ -4,7 +4,8 @@ import json
 import os
 from tqdm import tqdm
 
-from csp_utils import Constraint_Language, CSP_Instance, max_2sat_language, is_language
+from csp_utils import Constraint_Language, CSP_Instance, Instance_Cache, max_2sat_language, is_language
+from checkpoint_manager import Checkpoint_Manager
 
 
 class Message_Network:
@@ -197,17 +198,31 @@ class RUN_CSP_Cell:
 class RUN_CSP:
     """ A Tensorflow implementation of RUN-CSP """
 
-    def __init__(self, model_dir, language, state_size=128):
+    def __init__(self, model_dir, language, state_size=128, threads=None, inference=False):
         """
         :param model_dir: The directory to store the trained model in
         :param language: A Constraint_Language instance that specifies the underlying constraint language
         :param state_size: The length of the variable state vectors
+        :param threads: Optional number of threads for the session. Tensorflow uses all cores if None.
+        :param inference: If True, only the forward pass and the predictions are built and restored from an existing checkpoint.
+                          The loss, optimizer, metrics and summary writers are omitted and nothing is written to model_dir.
         """
+        self.inference = inference
+
+        # feed dicts of recently replicated instances, disabled unless an Instance_Cache with max_entries > 0 is assigned
+        self.feed_cache = Instance_Cache()
+
         # create session
-        self.session = tf.Session()
+        if threads is None:
+            config = None
+        else:
+            config = tf.compat.v1.ConfigProto(intra_op_parallelism_threads=threads, inter_op_parallelism_threads=threads)
+        self.session = tf.Session(config=config)
         self.session.as_default()
 
         self.model_dir = model_dir
+        if inference and not self.has_checkpoint():
+            raise ValueError(f'No trained model found in {model_dir}')
         if not os.path.exists(model_dir):
             os.mkdir(model_dir)
 
@@ -245,31 +260,60 @@ class RUN_CSP:
         self.idx_left = {r: tf.reshape(c[:, 0], [-1, 1]) for r, c in self.clauses.items()}
         self.idx_right = {r: tf.reshape(c[:, 1], [-1, 1]) for r, c in self.clauses.items()}
 
+        # placeholders for the clause weights of weighted instances, each clause has weight 1 if they are not fed
+        self.clause_weights = {r: tf.compat.v1.placeholder_with_default(tf.ones([tf.shape(c)[0]]), shape=[None]) for r, c in self.clauses.items()}
+
         # placeholder for the degrees, number of variables and clauses
         self.degrees = tf.compat.v1.placeholder(dtype=tf.int32)
         self.n_variables = tf.compat.v1.placeholder(dtype=tf.int32)
         self.n_clauses = tf.compat.v1.placeholder(dtype=tf.int32)
 
+        # placeholder for the number of parallel attempts in boosted predictions
+        self.attempts = tf.compat.v1.placeholder_with_default(1, shape=[])
+
+        # number of iterations that follow the current segment in truncated backpropagation through time, see train_batch
+        self.discount_offset = tf.compat.v1.placeholder_with_default(0, shape=[])
+
+        """
+        Placeholders for packed predictions, where multiple instances and their attempts are merged into one instance.
+        Each copy of an instance forms a segment. The segment of each clause and variable is given by the segment placeholders
+        and segment_instances maps each segment to the index of the packed instance it belongs to.
+        """
+        self.clause_segments = {r: tf.compat.v1.placeholder(dtype=tf.int32) for r in self.language.relation_names}
+        self.variable_segments = tf.compat.v1.placeholder(dtype=tf.int32)
+        self.segment_instances = tf.compat.v1.placeholder(dtype=tf.int32)
+        self.n_segments = tf.compat.v1.placeholder(dtype=tf.int32)
+        self.n_packed = tf.compat.v1.placeholder(dtype=tf.int32)
+
         # initializer for the dummy input of the network
         self.x_init = tf.zeros_initializer()
 
         # Construct the Cell of the RNN
         self.cell = RUN_CSP_Cell(self)
 
+        # initial states are sampled by the cell unless they are fed explicitly to continue a previous run
+        var_state_init, long_state_init = self.cell.get_initial_state()
+        self.init_var_states = tf.compat.v1.placeholder_with_default(var_state_init, shape=[None, state_size])
+        self.init_long_states = tf.compat.v1.placeholder_with_default(long_state_init, shape=[None, state_size])
+
         # use keras RNN class for the recurrent neural network
-        self.rnn = tf.keras.layers.RNN(self.cell, return_sequences=True)
+        self.rnn = tf.keras.layers.RNN(self.cell, return_sequences=True, return_state=True)
 
         # build the network
         self.build()
 
         # init writers for summaries
-        self.trainWriter = tf.compat.v1.summary.FileWriter(self.model_dir + '/train', self.session.graph)
-        self.testWriter = tf.compat.v1.summary.FileWriter(self.model_dir + '/test', self.session.graph)
-        self.summaries = tf.compat.v1.summary.merge_all()
+        if not self.inference:
+            self.trainWriter = tf.compat.v1.summary.FileWriter(self.model_dir + '/train', self.session.graph)
+            self.testWriter = tf.compat.v1.summary.FileWriter(self.model_dir + '/test', self.session.graph)
+            self.summaries = tf.compat.v1.summary.merge_all()
 
         var = [v for v in tf.compat.v1.local_variables()]
         self.rolling_variable_init = tf.compat.v1.variables_initializer(var)
 
+        # the savers are built once, snapshot variables for background writes are only needed for training
+        self.checkpoints = Checkpoint_Manager(self.session, self.model_dir, snapshot=not inference)
+
         if self.has_checkpoint():
             # reload checkpoint if this model has been trained already
             self.load_checkpoint()
@@ -287,7 +331,7 @@ class RUN_CSP:
         x = self.x_init(shape=([self.n_variables, self.iterations, 1]))
 
         # call rnn to get the color probabilites for each node and iteration
-        logits = self.rnn(x)
+        logits, self.var_states, self.long_states = self.rnn(x, initial_state=[self.init_var_states, self.init_long_states])
 
         if self.domain_size == 2:
             self.p = tf.reshape(tf.nn.sigmoid(logits), [self.n_variables, self.iterations, 1])
@@ -295,6 +339,15 @@ class RUN_CSP:
         else:
             self.phi = tf.nn.softmax(logits, axis=2)
 
+        if not self.inference:
+            self.build_training()
+
+        # build predictions and additional metrics
+        self.build_predictions()
+
+    def build_training(self):
+        """ Builds the loss and the training operation """
+
         # compute loss for each iteration
         loss = tf.reduce_sum(self.build_loss())
         # add result to collection loss
@@ -317,9 +370,15 @@ class RUN_CSP:
         gvs = optimizer.compute_gradients(tf.compat.v1.losses.get_total_loss())
         gvs = [(tf.clip_by_norm(grad, 1.0), var) for grad, var in gvs]
         self.train_op = optimizer.apply_gradients(gvs, self.global_step)
+        # update for the leading segments of truncated backpropagation through time, which do not count as training steps
+        self.segment_train_op = optimizer.apply_gradients(gvs)
 
-        # build predictions and additional metrics
-        self.build_predictions()
+        # separate ops to compute gradients and to apply externally averaged gradients for data-parallel training
+        self.loss = loss
+        self.trainable_variables = [var for _, var in gvs]
+        self.gradients = [grad for grad, _ in gvs]
+        self.gradient_inputs = [tf.compat.v1.placeholder(var.dtype.base_dtype, shape=var.shape) for var in self.trainable_variables]
+        self.apply_gradients_op = optimizer.apply_gradients(zip(self.gradient_inputs, self.trainable_variables), self.global_step)
 
     def build_loss(self):
         """
@@ -351,21 +410,26 @@ class RUN_CSP:
         loss = tf.add_n(relation_losses)
         loss = loss / tf.cast(self.n_clauses, tf.float32)
 
-        # compute and apply discount factor
-        discount = tf.tile(tf.constant([0.95]), [self.iterations])
-        exp = tf.cast(tf.range(self.iterations - 1, tf.constant(-1), tf.constant(-1)), dtype=tf.float32)
-        factor = tf.pow(discount, exp)
-        loss = factor * loss
+        # apply discount factor
+        loss = self.build_discount() * loss
 
         return loss
 
+    def build_discount(self):
+        """
+        :return: A 1 dimensional tensor with the discount factor of each iteration. The last iteration of a complete run has factor 1.
+        """
+        discount = tf.tile(tf.constant([0.95]), [self.iterations])
+        exp = tf.range(self.iterations - 1 + self.discount_offset, self.discount_offset - 1, tf.constant(-1))
+        return tf.pow(discount, tf.cast(exp, dtype=tf.float32))
+
     def build_predictions(self):
         """ Constructs the predictions and additional metrics """
 
         # compute hard assignment from final iteration
         self.assignment = tf.cast(tf.argmax(self.phi, axis=2), dtype=tf.int32)
 
-        # compute number of conflicting clauses for the assignment
+        # compute (weighted) number of conflicting clauses for the assignment
         relation_conflicts = []
         self.edge_conflicts = {}
         assignment = tf.reshape(self.assignment, [self.n_variables, self.iterations, 1])
@@ -375,9 +439,9 @@ class RUN_CSP:
             val_right = tf.gather_nd(assignment, self.idx_right[r])
             val_clause = tf.concat([val_left, val_right], axis=2)
 
-            # Count conflicting clauses of type r
+            # Count conflicting clauses of type r, weighted by their clause weights
             valid = tf.gather_nd(M, val_clause)
-            conflicts = 1.0 - valid
+            conflicts = (1.0 - valid) * tf.reshape(self.clause_weights[r], [-1, 1])
 
             self.edge_conflicts[r] = conflicts
             n_conflicts = tf.reduce_sum(conflicts[:, self.iterations-1])
@@ -386,14 +450,55 @@ class RUN_CSP:
         # sum up conflicts across all relations
         self.conflicts = tf.add_n(relation_conflicts)
 
+        # number of conflicts of each attempt at each iteration when the instance is replicated 'attempts' times
+        attempt_conflicts = [tf.reduce_sum(tf.reshape(c, [self.attempts, -1, self.iterations]), axis=1) for c in self.edge_conflicts.values()]
+        self.conflict_matrix = tf.add_n(attempt_conflicts)
+
+        # select the attempt and iteration with the fewest conflicts
+        best = tf.cast(tf.argmin(tf.reshape(self.conflict_matrix, [-1])), tf.int32)
+        self.best_attempt = best // self.iterations
+        self.best_iteration = best % self.iterations
+        self.all_assignments = tf.reshape(self.assignment, [self.attempts, -1, self.iterations])
+        self.best_assignment = self.all_assignments[self.best_attempt, :, self.best_iteration]
+        self.best_conflicts = self.conflict_matrix[self.best_attempt, self.best_iteration]
+
+        self.build_packed_predictions()
+
         # Add metric for relative number of conflicting clauses
         n_clauses = tf.cast(self.n_clauses, tf.float32)
+        if self.inference:
+            # no rolling metrics without local variables, the op yields the ratio of the current instance
+            self.conflict_ratio = self.conflict_ratio_op = self.conflicts / n_clauses
+            return
         self.conflict_ratio, self.conflict_ratio_op = tf.compat.v1.metrics.mean(self.conflicts / n_clauses)
 
         # Add summaries
         with tf.name_scope('summaries'):
             tf.compat.v1.summary.scalar('conflict_ratio', self.conflict_ratio_op)
 
+    def build_packed_predictions(self):
+        """ Constructs the selection of the best segment and iteration for each instance of a packed prediction """
+
+        # number of conflicts of each segment at each iteration
+        segment_conflicts = [tf.math.unsorted_segment_sum(self.edge_conflicts[r], self.clause_segments[r], self.n_segments)
+                             for r in self.language.relation_names]
+        segment_conflicts = tf.add_n(segment_conflicts)
+        segment_best_iteration = tf.cast(tf.argmin(segment_conflicts, axis=1), tf.int32)
+        segment_best_conflicts = tf.reduce_min(segment_conflicts, axis=1)
+
+        # the best segment of each instance is the first one that reaches the least number of conflicts
+        self.packed_conflicts = tf.math.unsorted_segment_min(segment_best_conflicts, self.segment_instances, self.n_packed)
+        is_best = tf.equal(segment_best_conflicts, tf.gather(self.packed_conflicts, self.segment_instances))
+        segment_ids = tf.where(is_best, tf.range(self.n_segments), tf.fill([self.n_segments], self.n_segments))
+        self.packed_segments = tf.math.unsorted_segment_min(segment_ids, self.segment_instances, self.n_packed)
+        self.packed_iterations = tf.gather(segment_best_iteration, self.packed_segments)
+
+        # assignment of each variable at the best iteration of its segment, restricted to the best segment of each instance
+        variable_iteration = tf.gather(segment_best_iteration, self.variable_segments)
+        values = tf.gather_nd(self.assignment, tf.stack([tf.range(self.n_variables), variable_iteration], axis=1))
+        best_segment = tf.gather(self.packed_segments, tf.gather(self.segment_instances, self.variable_segments))
+        self.packed_assignment = tf.boolean_mask(values, tf.equal(self.variable_segments, best_segment))
+
     def get_feed_dict(self, instance, iterations):
         """ Creates a Tensorflow feed dict for a given csp instance """
         feed_dict = {self.iterations: iterations,
@@ -401,41 +506,108 @@ class RUN_CSP:
                      self.n_clauses: instance.n_clauses,
                      self.degrees: instance.degrees}
 
+        clauses, clause_weights = instance.clauses, instance.clause_weights
         for r in self.language.relation_names:
-            feed_dict[self.clauses[r]] = instance.clauses[r]
+            feed_dict[self.clauses[r]] = clauses[r]
+            if instance.weighted:
+                feed_dict[self.clause_weights[r]] = clause_weights[r]
             
         return feed_dict
 
-    def train(self, instances, iterations):
+    def train(self, instances, iterations, epoch=0, truncation=None):
         """
         Performs one training epoch.
         :param instances: A list of CSP_Instance objects to perform training on.
         :param iterations: The number of iterations that RUN-CSP performs on each instances.
+        :param epoch: The current epoch, which is stored in periodic checkpoints (see Checkpoint_Manager.save_every)
+        :param truncation: If specified, gradients are only backpropagated through segments of this many iterations (see train_batch)
         :return: A dictionary that contains the mean ratio of conflicting edges across all instances.
         """
+        if self.inference:
+            raise RuntimeError('Networks constructed for inference can not be trained')
         self.session.run(self.rolling_variable_init)
 
         print('Training...')
         for instance in tqdm(instances):
-            feed_dict = self.get_feed_dict(instance, iterations)
             out = [self.train_op, self.conflict_ratio_op, self.summaries, self.global_step]
-            res = self.session.run(out, feed_dict=feed_dict)
+            res = self.train_batch(instance, iterations, out, truncation)
+            self.checkpoints.maybe_save(res[3], epoch)
 
         self.trainWriter.add_summary(res[2], res[3])
 
         output = {'conflict_ratio': res[1]}
         return output
 
-    def predict(self, instance, iterations):
+    def train_batch(self, instance, iterations, out, truncation=None):
+        """
+        Performs one training step on a batch. With truncated backpropagation through time, the iterations are unrolled
+        in segments of 'truncation' iterations. Each segment minimizes its own part of the discounted loss and passes its
+        final states to the next segment as constants, such that the memory only depends on the segment length.
+        The leading segments update the weights without advancing the global step, the last segment runs 'out'.
+        :param instance: A CSP_Instance object, i.e. a merged batch
+        :param iterations: The total number of iterations that RUN-CSP performs on the instance
+        :param out: The fetches of the last segment, which include self.train_op and the metric update ops
+        :param truncation: Optional number of iterations per segment. All iterations are unrolled at once if None.
+        :return: The fetched values of 'out'
+        """
+        feed_dict = self.get_feed_dict(instance, iterations)
+        if truncation is None:
+            return self.session.run(out, feed_dict=feed_dict)
+
+        for start in range(0, iterations, truncation):
+            feed_dict[self.iterations] = min(truncation, iterations - start)
+            feed_dict[self.discount_offset] = iterations - start - feed_dict[self.iterations]
+            if feed_dict[self.discount_offset] == 0:
+                return self.session.run(out, feed_dict=feed_dict)
+
+            # fetched states are fed as constants, which stops the gradient between segments
+            _, var_states, long_states = self.session.run([self.segment_train_op, self.var_states, self.long_states], feed_dict=feed_dict)
+            feed_dict[self.init_var_states] = var_states
+            feed_dict[self.init_long_states] = long_states
+
+    def get_weights(self):
+        """ :return: A list with the values of all trainable variables """
+        return self.session.run(self.trainable_variables)
+
+    def set_weights(self, weights):
+        """ :param weights: A list with new values of all trainable variables, as returned by get_weights """
+        for var, value in zip(self.trainable_variables, weights):
+            var.load(value, self.session)
+
+    def compute_gradients(self, instance, iterations):
+        """
+        Computes the clipped gradients of the loss on one batch without applying them
+        :param instance: A CSP_Instance object, i.e. a merged batch
+        :param iterations: The number of iterations that RUN-CSP performs on the instance
+        :return: A list with the gradient of each trainable variable and a dictionary with the loss and the conflict ratio
+        """
+        feed_dict = self.get_feed_dict(instance, iterations)
+        gradients, loss, conflicts = self.session.run([self.gradients, self.loss, self.conflicts], feed_dict=feed_dict)
+        return gradients, {'loss': loss, 'conflict_ratio': conflicts / instance.n_clauses}
+
+    def apply_gradients(self, gradients):
+        """
+        Performs one optimizer step with the given gradients, i.e. the average of the gradients of multiple workers
+        :param gradients: A list with the gradient of each trainable variable
+        :return: The new global step
+        """
+        feed_dict = dict(zip(self.gradient_inputs, gradients))
+        self.session.run(self.apply_gradients_op, feed_dict=feed_dict)
+        return self.session.run(self.global_step)
+
+    def predict(self, instance, iterations, initial_states=None):
         """
         Generates predictions for a given instance.
         :param instance: A CSP_Instance object.
         :param iterations: The number of iterations that RUN-CSP performs on each instances.
+        :param initial_states: Optional tuple (var_states, long_states) with shape (n_variables, state_size) each. Randomly initialized if not given.
         :return: A dictionary that contains the final hard assignment as well as the number of conflicts.
         """
         self.session.run(self.rolling_variable_init)
 
         feed_dict = self.get_feed_dict(instance, iterations)
+        if initial_states is not None:
+            feed_dict[self.init_var_states], feed_dict[self.init_long_states] = initial_states
 
         out = [self.assignment, self.conflicts, self.conflict_ratio_op, self.phi, self.edge_conflicts]
         res = self.session.run(out, feed_dict=feed_dict)
@@ -447,67 +619,144 @@ class RUN_CSP:
                   'edge_conflicts': res[4]}
         return output
 
-    def predict_boosted(self, instance, iterations, attempts):
+    def get_boosted_feed_dict(self, instance, iterations, attempts):
+        """
+        Creates the feed dict of predict_boosted, which merges 'attempts' many copies of the instance.
+        The replicated arrays are taken from self.feed_cache when it is enabled and the same instance is solved repeatedly.
+        """
+        def build():
+            feed_dict = self.get_feed_dict(instance.replicate(attempts), iterations)
+            feed_dict[self.attempts] = attempts
+            return feed_dict
+
+        # copy the cached dict, since predict_boosted sets the iterations and states
+        feed_dict = dict(self.feed_cache.get(instance, attempts, build))
+        feed_dict[self.iterations] = iterations
+        return feed_dict
+
+    def predict_boosted(self, instance, iterations, attempts, return_all=False, chunk_size=None, stop_conflicts=None, stop_quorum=1, feed_dict=None):
         """
         Generate predictions with boosted performance by making multiple runs in paralleland using the best results.
+        The best attempt and iteration are selected inside the graph, such that only the winning assignment is fetched.
         :param instance: A CSP_Instance object.
         :param iterations: The number of iterations that RUN-CSP performs on each instances.
         :param attempts: The number of parallel runs.
-        :return: The predictions for the run with the least conflicts
+        :param return_all: If True, the assignments of all attempts and iterations are also returned as 'all_assignments'.
+        :param chunk_size: If specified, the network runs for at most chunk_size iterations per session call
+                           and carries the variable states between calls. This bounds the memory independently of iterations.
+        :param stop_conflicts: If specified, the conflicts are checked after each chunk and the run terminates early
+                               once stop_quorum attempts have found an assignment with at most stop_conflicts conflicts.
+                               The chunk size defaults to 10 iterations in this case.
+        :param stop_quorum: The number of attempts that have to reach stop_conflicts before terminating early.
+        :param feed_dict: Optional feed dict that was prepared in advance by get_boosted_feed_dict
+        :return: The predictions for the run with the least conflicts. 'iterations' holds the number of iterations that were performed.
         """
         # duplicate instance and generate predictions in parallel
-        combined = CSP_Instance.merge([instance for _ in range(attempts)])
-        output_dict = self.predict(combined, iterations=iterations)
-
-        # soft assignments for all iterations
-        phi = output_dict['phi']
-        phi = np.reshape(phi, (attempts, instance.n_variables, iterations, instance.language.domain_size))
-
-        # compute hard assignments
-        assignments = np.argmax(phi, axis=3)
-
-        # compute number of conflicts in each attempts at each iteration
-        conf = np.zeros([attempts, iterations], np.int64)
-        for r in instance.language.relations:
-            # get binary encoding of whether or not each constraint has a conflict
-            edge_conf = output_dict['edge_conflicts'][r]
-            edge_conf = np.reshape(edge_conf, [attempts, len(instance.clauses[r]), iterations])
-            conf += np.int64(np.sum(edge_conf, axis=1))
-
-        # select solution with fewest conflicts as final output
-        best = np.unravel_index(np.argmin(conf, axis=None), conf.shape)
-        best_assignment = assignments[best[0], :, best[1]]
-        best_conflicts = conf[best]
-        best_conflict_ratio = best_conflicts / instance.n_clauses
-        
+        if feed_dict is None:
+            feed_dict = self.get_boosted_feed_dict(instance, iterations, attempts)
+
+        if chunk_size is None:
+            chunk_size = iterations if stop_conflicts is None else 10
+
+        out = [self.best_assignment, self.best_conflicts, self.best_iteration, self.best_attempt, self.conflict_matrix]
+        if return_all:
+            out.append(self.all_assignments)
+        # the states are only fetched if another chunk continues from them
+        states = [self.var_states, self.long_states]
+
+        best_assignment, best_conflicts, best_iteration, best_attempt = None, None, None, None
+        all_conflicts, all_assignments = [], []
+        attempt_conflicts = np.full([attempts], np.inf)
+        performed = 0
+        for start in range(0, iterations, chunk_size):
+            feed_dict[self.iterations] = min(chunk_size, iterations - start)
+            performed = start + feed_dict[self.iterations]
+            res = self.session.run(out + states if performed < iterations else out, feed_dict=feed_dict)
+
+            # keep the best assignment seen so far
+            if best_conflicts is None or res[1] < best_conflicts:
+                best_assignment, best_conflicts = res[0], res[1]
+                best_iteration, best_attempt = start + res[2], res[3]
+            all_conflicts.append(res[4])
+            if return_all:
+                all_assignments.append(res[5])
+
+            # stop once enough attempts have reached the target number of conflicts
+            attempt_conflicts = np.minimum(attempt_conflicts, np.min(res[4], axis=1))
+            if stop_conflicts is not None and np.sum(attempt_conflicts <= stop_conflicts) >= stop_quorum:
+                break
+
+            # carry the states to the next chunk
+            if performed < iterations:
+                feed_dict[self.init_var_states], feed_dict[self.init_long_states] = res[-2:]
+
+        # conflicts are only fractional for weighted instances
+        all_conflicts = np.concatenate(all_conflicts, axis=1)
+        if not instance.weighted:
+            best_conflicts, all_conflicts = np.int64(best_conflicts), np.int64(all_conflicts)
+
         output = {'assignment': best_assignment,
                   'conflicts': best_conflicts,
-                  'conflict_ratio': best_conflict_ratio,
-                  'all_assignments': assignments,
-                  'all_conflicts': conf}
+                  'conflict_ratio': best_conflicts / instance.n_clauses,
+                  'best_attempt': best_attempt,
+                  'best_iteration': best_iteration,
+                  'iterations': performed,
+                  'all_conflicts': all_conflicts}
+        if return_all:
+            output['all_assignments'] = np.concatenate(all_assignments, axis=2)
         return output
-        
+
+    def predict_packed(self, instances, iterations, attempts):
+        """
+        Generate boosted predictions for multiple instances in one pass by packing all attempts of all instances into one instance.
+        :param instances: A list of CSP_Instance objects.
+        :param iterations: The number of iterations that RUN-CSP performs on each instances.
+        :param attempts: The number of parallel runs for each instance.
+        :return: A list with the predictions for the run with the least conflicts of each instance
+        """
+        copies = [instance for instance in instances for _ in range(attempts)]
+        combined = CSP_Instance.merge([instance.replicate(attempts) for instance in instances])
+        feed_dict = self.get_feed_dict(combined, iterations)
+
+        # assign each copy of an instance its own segment
+        segments = np.arange(len(copies), dtype=np.int32)
+        clause_counts = np.array([np.diff(c.relation_offsets) for c in copies])
+        for k, r in enumerate(self.language.relation_names):
+            feed_dict[self.clause_segments[r]] = np.repeat(segments, clause_counts[:, k])
+        feed_dict[self.variable_segments] = np.repeat(segments, [c.n_variables for c in copies])
+        feed_dict[self.segment_instances] = np.repeat(np.arange(len(instances), dtype=np.int32), attempts)
+        feed_dict[self.n_segments] = len(copies)
+        feed_dict[self.n_packed] = len(instances)
+
+        out = [self.packed_assignment, self.packed_conflicts, self.packed_segments, self.packed_iterations]
+        assignment, conflicts, best_segments, best_iterations = self.session.run(out, feed_dict=feed_dict)
+
+        # split the concatenated best assignments back into the instances
+        offsets = np.cumsum([0] + [instance.n_variables for instance in instances])
+        outputs = []
+        for i, instance in enumerate(instances):
+            best_conflicts = conflicts[i] if instance.weighted else np.int64(conflicts[i])
+            output = {'assignment': assignment[offsets[i]:offsets[i + 1]],
+                      'conflicts': best_conflicts,
+                      'conflict_ratio': best_conflicts / instance.n_clauses,
+                      'best_attempt': best_segments[i] - i * attempts,
+                      'best_iteration': best_iterations[i]}
+            outputs.append(output)
+        return outputs
+
     def save_checkpoint(self, name='best'):
         """
         Save the current graph and summaries in the model directory
         :param name: Name of the checkpoint
         """
-        path = os.path.join(self.model_dir, f"model_{name}.ckpt")
-
-        session = self.session
-        saver = tf.compat.v1.train.Saver()
-        path = saver.save(session, path)
-        print("Model saved in file: %s" % path)
+        self.checkpoints.save(name)
 
     def load_checkpoint(self, name='best'):
         """
         Load a checkpoint from the model directory
         :param name: Name of the checkpoint
         """
-        path = os.path.join(self.model_dir, f"model_{name}.ckpt")
-        session = self.session
-        saver = tf.compat.v1.train.Saver()
-        saver.restore(session, path)
+        self.checkpoints.restore(name)
 
     def has_checkpoint(self):
         """ Check if network has some checkpoint stored in the model directory """
@@ -523,10 +772,12 @@ class RUN_CSP:
         self.language.save(os.path.join(self.model_dir, 'language.json'))
 
     @staticmethod
-    def load(model_dir):
+    def load(model_dir, threads=None, inference=True):
         """
         Loads a network from its model directory
         :param model_dir: The directory
+        :param threads: Optional number of threads for the session
+        :param inference: If True, only the parts of the network needed for predictions are built and restored
         :return: The loaded RUN-CSP Network
         """
         with open(os.path.join(model_dir, "parameters.json"), 'r') as f:
@@ -535,27 +786,27 @@ class RUN_CSP:
         state_size = parameters['state_size']
         language = Constraint_Language.load(os.path.join(model_dir, 'language.json'))
 
-        network = RUN_CSP(model_dir, language, state_size)
+        network = RUN_CSP(model_dir, language, state_size, threads=threads, inference=inference)
         return network
 
 
 class Coloring_Network(RUN_CSP):
     """ A RUN-CSP instance that performs 3 coloring on graphs """
-    def __init__(self, model_dir, colors=3, state_size=128):
-        super().__init__(model_dir, Constraint_Language.get_coloring_language(colors), state_size=state_size)
+    def __init__(self, model_dir, colors=3, state_size=128, threads=None, inference=False):
+        super().__init__(model_dir, Constraint_Language.get_coloring_language(colors), state_size=state_size, threads=threads, inference=inference)
 
 
 class Max_2SAT_Network(RUN_CSP):
     """ A RUN-CSP instance for the Max2Sat problem """
-    def __init__(self, model_dir, state_size=128):
-        super().__init__(model_dir, max_2sat_language, state_size=state_size)
+    def __init__(self, model_dir, state_size=128, threads=None, inference=False):
+        super().__init__(model_dir, max_2sat_language, state_size=state_size, threads=threads, inference=inference)
 
 
 class Max_IS_Network(RUN_CSP):
     """ A Modified RUN-CSP instance for the Max Independent Set Problem """
-    def __init__(self, model_dir, kappa=1.0, state_size=128):
+    def __init__(self, model_dir, kappa=1.0, state_size=128, threads=None, inference=False):
         self.kappa = kappa
-        super().__init__(model_dir, is_language, state_size=state_size)
+        super().__init__(model_dir, is_language, state_size=state_size, threads=threads, inference=inference)
 
     def build_loss(self):
         """
@@ -564,12 +815,8 @@ class Max_IS_Network(RUN_CSP):
         # get standard run-csp loss first
         is_loss = super().build_loss()
 
-        discount = tf.tile(tf.constant([0.95]), [self.iterations])
-        exp = tf.cast(tf.range(self.iterations - 1, tf.constant(-1), tf.constant(-1)), dtype=tf.float32)
-        factor = tf.pow(discount, exp)
-
         # loss that rewards larger sets
-        max_loss = factor * (1.0 - tf.reduce_mean(self.p, axis=0))
+        max_loss = self.build_discount() * (1.0 - tf.reduce_mean(self.p, axis=0))
 
         # product to combine losses
         loss = (self.kappa + is_loss) * (1.0 + max_loss)
@@ -580,31 +827,39 @@ class Max_IS_Network(RUN_CSP):
         super().build_predictions()
 
         self.size_IS = tf.count_nonzero(self.assignment[:, self.iterations-1], dtype=tf.float32)
-        self.IS_ratio, self.IS_ratio_op = tf.compat.v1.metrics.mean(self.size_IS / tf.cast(self.n_variables, dtype=tf.float32))
-
+        is_ratio = self.size_IS / tf.cast(self.n_variables, dtype=tf.float32)
         corrected_ratio = (tf.cast(self.size_IS, tf.float32) - self.conflicts) / tf.cast(self.n_variables, tf.float32)
+
+        if self.inference:
+            self.IS_ratio = self.IS_ratio_op = is_ratio
+            self.corrected_ratio = self.corrected_ratio_op = corrected_ratio
+            return
+
+        self.IS_ratio, self.IS_ratio_op = tf.compat.v1.metrics.mean(is_ratio)
         self.corrected_ratio, self.corrected_ratio_op = tf.compat.v1.metrics.mean(corrected_ratio)
 
         # Add summaries
         with tf.name_scope('summaries'):
             tf.compat.v1.summary.scalar('is_ratio', self.IS_ratio_op)
 
-    def train(self, batches, iterations):
+    def train(self, batches, iterations, epoch=0, truncation=None):
         """ Add Independent Set size to output """
+        if self.inference:
+            raise RuntimeError('Networks constructed for inference can not be trained')
         self.session.run(self.rolling_variable_init)
 
         print('Training Network...')
         for batch in tqdm(batches):
-            feed_dict = self.get_feed_dict(batch, iterations)
             out = [self.train_op, self.conflict_ratio_op, self.summaries, self.global_step, self.IS_ratio_op, self.corrected_ratio_op]
-            res = self.session.run(out, feed_dict=feed_dict)
+            res = self.train_batch(batch, iterations, out, truncation)
+            self.checkpoints.maybe_save(res[3], epoch)
 
         self.trainWriter.add_summary(res[2], res[3])
 
         output = {'conflict_ratio': res[1], 'is_ratio': res[4], 'corrected_ratio': res[5]}
         return output
     
-    def predict_boosted_and_corrected(self, instance, iterations, attempts):
+    def predict_boosted_and_corrected(self, instance, iterations, attempts, feed_dict=None):
         """
         Generate predictions with boosted performance by making multiple runs in parallel and using the best result.
         This method also computes the IS size after a simple post-processing step,
@@ -612,10 +867,11 @@ class Max_IS_Network(RUN_CSP):
         :param instance: A CSP_Instance object.
         :param iterations: The number of iterations that RUN-CSP performs on each instances.
         :param attempts: The number of parallel runs.
+        :param feed_dict: Optional feed dict that was prepared in advance by get_boosted_feed_dict
         :return: The predictions for the run with the least conflicts
         """
         # duplicate instance and generate predictions in parallel
-        output_dict = super().predict_boosted(instance, iterations=iterations, attempts=attempts)
+        output_dict = super().predict_boosted(instance, iterations=iterations, attempts=attempts, return_all=True, feed_dict=feed_dict)
 
         assignments = output_dict['all_assignments']
         is_sizes = np.sum(assignments, axis=1)
@@ -644,5 +900,5 @@ class Max_IS_Network(RUN_CSP):
         return output
 
     @staticmethod
-    def load(model_dir):
-        return Max_IS_Network(model_dir)
\ No newline at end of file
+    def load(model_dir, threads=None, inference=True):
+        return Max_IS_Network(model_dir, threads=threads, inference=inference)
\ No newline at end of file
@@ -0,0 +1,425 @@
+import numpy as np
+import scipy.sparse as sp
+import struct
+import json
+import os
+
+from csp_utils import Constraint_Language, Instance_Cache
+
+
+# numpy types of the tensorflow DataType enum values that can occur in a RUN-CSP checkpoint
+TF_DTYPES = {1: np.float32, 2: np.float64, 3: np.int32, 4: np.uint8, 6: np.int8, 9: np.int64, 10: np.bool_}
+
+# magic number at the end of every tensorflow table file
+TABLE_MAGIC = 0xdb4775248b80fb57
+
+
+def read_varint(buffer, pos):
+    """
+    Decodes a base 128 varint
+    :param buffer: A bytes object
+    :param pos: The position of the first byte of the varint
+    :return: The decoded integer and the position of the next byte
+    """
+    result = 0
+    shift = 0
+    while True:
+        b = buffer[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def parse_proto(buffer):
+    """
+    Minimal protobuf wire format decoder
+    :param buffer: A serialized protobuf message
+    :return: A dict that maps each field number to the list of its (undecoded) values
+    """
+    fields = {}
+    pos = 0
+    while pos < len(buffer):
+        key, pos = read_varint(buffer, pos)
+        number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = read_varint(buffer, pos)
+        elif wire_type == 1:
+            value = buffer[pos:pos + 8]
+            pos += 8
+        elif wire_type == 2:
+            length, pos = read_varint(buffer, pos)
+            value = buffer[pos:pos + length]
+            pos += length
+        elif wire_type == 5:
+            value = buffer[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f'Unsupported protobuf wire type {wire_type}')
+        fields.setdefault(number, []).append(value)
+    return fields
+
+
+class Checkpoint_Reader:
+    """ Reads the variables of a tensorflow checkpoint (V2 bundle format) without importing tensorflow """
+
+    def __init__(self, path):
+        """
+        :param path: The checkpoint prefix, i.e. 'models/2SAT/model_best.ckpt'
+        """
+        self.path = path
+        with open(path + '.index', 'rb') as f:
+            self.index = f.read()
+
+        # the footer holds the handles of the metaindex and index blocks followed by the magic number
+        footer = self.index[-48:]
+        if struct.unpack('<Q', footer[-8:])[0] != TABLE_MAGIC:
+            raise ValueError(f'{path}.index is not a tensorflow checkpoint index')
+        _, pos = read_varint(footer, 0)
+        _, pos = read_varint(footer, pos)
+        index_offset, pos = read_varint(footer, pos)
+        index_size, pos = read_varint(footer, pos)
+
+        # the index block maps the last key of each data block to the handle of that block
+        self.entries = {}
+        for _, handle in self.read_block(index_offset, index_size):
+            offset, pos = read_varint(handle, 0)
+            size, _ = read_varint(handle, pos)
+            for name, value in self.read_block(offset, size):
+                # the empty key holds the bundle header, all other keys are variable names
+                if name:
+                    self.entries[name.decode('utf-8')] = parse_proto(value)
+
+    def read_block(self, offset, size):
+        """
+        Decodes the key value pairs of a (uncompressed) table block
+        :param offset: Offset of the block in the index file
+        :param size: Size of the block without its trailer
+        :return: A list of (key, value) tuples
+        """
+        if self.index[offset + size] != 0:
+            raise ValueError('Compressed checkpoint index blocks are not supported')
+
+        block = self.index[offset:offset + size]
+        n_restarts = struct.unpack('<I', block[-4:])[0]
+        end = size - 4 * (n_restarts + 1)
+
+        entries = []
+        key = b''
+        pos = 0
+        while pos < end:
+            shared, pos = read_varint(block, pos)
+            non_shared, pos = read_varint(block, pos)
+            value_length, pos = read_varint(block, pos)
+            key = key[:shared] + block[pos:pos + non_shared]
+            pos += non_shared
+            entries.append((key, block[pos:pos + value_length]))
+            pos += value_length
+        return entries
+
+    def variable_names(self):
+        return sorted(self.entries.keys())
+
+    def get_tensor(self, name):
+        """
+        :param name: The name of a variable in the checkpoint
+        :return: The value of the variable as a numpy array
+        """
+        entry = self.entries[name]
+        dtype = TF_DTYPES[entry.get(1, [1])[0]]
+        shape = []
+        if 2 in entry:
+            for dim in parse_proto(entry[2][0]).get(2, []):
+                shape.append(parse_proto(dim).get(1, [0])[0])
+        shard = entry.get(3, [0])[0]
+        offset = entry.get(4, [0])[0]
+        size = entry.get(5, [0])[0]
+
+        n_shards = len([p for p in os.listdir(os.path.dirname(self.path) or '.')
+                        if p.startswith(os.path.basename(self.path) + '.data-')])
+        with open(f'{self.path}.data-{shard:05d}-of-{n_shards:05d}', 'rb') as f:
+            f.seek(offset)
+            buffer = f.read(size)
+
+        return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+
+def hard_sigmoid(x):
+    # piecewise linear approximation of the sigmoid, the default recurrent activation of keras LSTM cells
+    return np.clip(0.2 * x + 0.5, 0.0, 1.0)
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def softmax(x, axis=-1):
+    e = np.exp(x - np.max(x, axis=axis, keepdims=True))
+    return e / np.sum(e, axis=axis, keepdims=True)
+
+
+class NumPy_Batch_Normalization:
+    """ Inference mode of the keras BatchNormalization layer """
+
+    def __init__(self, gamma, beta, moving_mean, moving_variance, epsilon=1e-3):
+        # fold the normalization into a single affine transformation
+        self.scale = np.float32(gamma / np.sqrt(moving_variance + epsilon))
+        self.offset = np.float32(beta - moving_mean * self.scale)
+
+    def __call__(self, x):
+        return x * self.scale + self.offset
+
+
+class NumPy_Message_Network:
+    """ NumPy version of Message_Network """
+
+    def __init__(self, kernel, norm):
+        """
+        :param kernel: The kernel of the output layer with shape (2h, 2h)
+        :param norm: A NumPy_Batch_Normalization for the output
+        """
+        self.kernel = kernel
+        self.norm = norm
+        self.out_units = kernel.shape[1] // 2
+
+    def __call__(self, in_left, in_right):
+        y = np.concatenate([in_left, in_right], axis=1)
+        y = self.norm(y @ self.kernel)
+        return y[:, :self.out_units], y[:, self.out_units:]
+
+
+class NumPy_Symmetric_Message_Network:
+    """ NumPy version of Symmetric_Message_Network """
+
+    def __init__(self, kernel, norm):
+        """
+        :param kernel: The kernel of the output layer with shape (2h, h)
+        :param norm: A NumPy_Batch_Normalization for the output
+        """
+        self.kernel = kernel
+        self.norm = norm
+
+    def __call__(self, in_right, in_left):
+        # the argument order mirrors Symmetric_Message_Network, which swaps both endpoints
+        msg_left = self.norm(np.concatenate([in_left, in_right], axis=1) @ self.kernel)
+        msg_right = self.norm(np.concatenate([in_right, in_left], axis=1) @ self.kernel)
+        return msg_left, msg_right
+
+
+class NumPy_RUN_CSP:
+    """
+    A TensorFlow free implementation of the RUN-CSP forward pass.
+    Loads the weights of a trained RUN_CSP model directory and performs inference with vectorized numpy operations.
+    """
+
+    def __init__(self, language, weights, state_size=128):
+        """
+        :param language: A Constraint_Language instance that specifies the underlying constraint language
+        :param weights: A dict that maps the variable names of a RUN_CSP checkpoint to numpy arrays
+        :param state_size: The length of the variable state vectors
+        """
+        self.language = language
+        self.domain_size = language.domain_size
+        self.state_size = state_size
+        self.relation_matrices = language.relation_matrices
+
+        # replicated instances and their scatter matrices, disabled unless an Instance_Cache with max_entries > 0 is assigned
+        self.replication_cache = Instance_Cache()
+
+        # keras numbers its layers in order of construction, which follows the order used in RUN_CSP and RUN_CSP_Cell
+        n_dense = 0
+        n_norm = 0
+
+        def layer_name(prefix, i):
+            return f'rnn/{prefix}' if i == 0 else f'rnn/{prefix}_{i}'
+
+        def get_norm():
+            nonlocal n_norm
+            name = layer_name('batch_normalization', n_norm)
+            n_norm += 1
+            return NumPy_Batch_Normalization(weights[f'{name}/gamma'], weights[f'{name}/beta'],
+                                             weights[f'{name}/moving_mean'], weights[f'{name}/moving_variance'])
+
+        def get_kernel():
+            nonlocal n_dense
+            name = layer_name('dense', n_dense)
+            n_dense += 1
+            return weights[f'{name}/kernel']
+
+        # message network of each relation
+        self.message_networks = {}
+        for r, M in self.relation_matrices.items():
+            symmetric = np.allclose(M, M.T, rtol=1e-05, atol=1e-08)
+            network_class = NumPy_Symmetric_Message_Network if symmetric else NumPy_Message_Network
+            kernel = get_kernel()
+            self.message_networks[r] = network_class(kernel, get_norm())
+
+        # normalization of received messages, LSTM update and output reduction of RUN_CSP_Cell
+        self.normalize = get_norm()
+        self.lstm_kernel = weights['rnn/lstm_cell/kernel']
+        self.lstm_recurrent_kernel = weights['rnn/lstm_cell/recurrent_kernel']
+        self.lstm_bias = weights['rnn/lstm_cell/bias']
+        self.out_reduction = get_kernel()
+
+    def get_initial_state(self, n_variables):
+        """ Samples initial states with the same distribution as RUN_CSP_Cell.get_initial_state """
+        var_states = np.float32(np.random.normal(size=[n_variables, self.state_size]))
+        long_states = np.zeros([n_variables, self.state_size], dtype=np.float32)
+        return var_states, long_states
+
+    def step(self, instance, var_states, long_states, scatter=None):
+        """
+        Performs one iteration of RUN_CSP_Cell.call
+        :param instance: A CSP_Instance object
+        :param var_states: The current variable states with shape (n_variables, state_size)
+        :param long_states: The current long term LSTM states with shape (n_variables, state_size)
+        :param scatter: Optional precomputed result of get_scatter_matrices(instance)
+        :return: The logits and a tuple with the next states
+        """
+        if scatter is None:
+            scatter = self.get_scatter_matrices(instance)
+
+        rec = np.zeros_like(var_states)
+        for r in self.language.relation_names:
+            clauses = instance.clauses[r]
+            if len(clauses) == 0:
+                continue
+            msg_left, msg_right = self.message_networks[r](var_states[clauses[:, 0]], var_states[clauses[:, 1]])
+            scatter_left, scatter_right = scatter[r]
+            rec += scatter_left @ msg_left + scatter_right @ msg_right
+
+        # normalize with inverse degrees, isolated variables receive no messages
+        degrees = np.float32(instance.degrees).reshape([-1, 1])
+        rec = np.divide(rec, degrees, out=np.zeros_like(rec), where=degrees > 0)
+        rec = self.normalize(rec)
+
+        # LSTM update with gates in keras order (input, forget, cell, output)
+        z = rec @ self.lstm_kernel + var_states @ self.lstm_recurrent_kernel + self.lstm_bias
+        z_i, z_f, z_c, z_o = np.split(z, 4, axis=1)
+        long_states = hard_sigmoid(z_f) * long_states + hard_sigmoid(z_i) * np.tanh(z_c)
+        var_states = hard_sigmoid(z_o) * np.tanh(long_states)
+
+        logits = var_states @ self.out_reduction
+        return logits, (var_states, long_states)
+
+    def get_scatter_matrices(self, instance):
+        """
+        :param instance: A CSP_Instance object
+        :return: A dict with a pair of sparse (n_variables, n_r) matrices for each relation r that sum up clause messages per variable
+        """
+        scatter = {}
+        for r in self.language.relation_names:
+            clauses = instance.clauses[r]
+            if len(clauses) == 0:
+                continue
+            ones = np.ones(len(clauses), dtype=np.float32)
+            cols = np.arange(len(clauses))
+            shape = (instance.n_variables, len(clauses))
+            scatter[r] = (sp.csr_matrix((ones, (clauses[:, 0], cols)), shape=shape),
+                          sp.csr_matrix((ones, (clauses[:, 1], cols)), shape=shape))
+        return scatter
+
+    def replicate(self, instance, attempts):
+        """ :return: The merged copies of the instance for predict_boosted and their scatter matrices """
+        combined = instance.replicate(attempts)
+        return combined, self.get_scatter_matrices(combined)
+
+    def get_soft_assignment(self, logits):
+        """ Maps logits to soft assignments phi with shape (..., domain_size) as in RUN_CSP.build """
+        if self.domain_size == 2:
+            p = sigmoid(logits)
+            return np.concatenate([1.0 - p, p], axis=-1)
+        else:
+            return softmax(logits, axis=-1)
+
+    def predict(self, instance, iterations, initial_states=None, scatter=None):
+        """
+        Generates predictions for a given instance.
+        :param instance: A CSP_Instance object.
+        :param iterations: The number of iterations that RUN-CSP performs on each instances.
+        :param initial_states: Optional tuple (var_states, long_states). Randomly initialized if not given.
+        :param scatter: Optional precomputed result of get_scatter_matrices(instance)
+        :return: A dictionary with the same entries as the output of RUN_CSP.predict.
+        """
+        if initial_states is None:
+            initial_states = self.get_initial_state(instance.n_variables)
+        var_states, long_states = initial_states
+
+        if scatter is None:
+            scatter = self.get_scatter_matrices(instance)
+        phi = np.zeros([instance.n_variables, iterations, self.domain_size], dtype=np.float32)
+        for t in range(iterations):
+            logits, (var_states, long_states) = self.step(instance, var_states, long_states, scatter)
+            phi[:, t, :] = self.get_soft_assignment(logits)
+
+        assignment = np.int32(np.argmax(phi, axis=2))
+
+        edge_conflicts = {}
+        conflicts = 0.0
+        for r, M in self.relation_matrices.items():
+            clauses = instance.clauses[r].reshape([-1, 2])
+            edge_conflicts[r] = 1.0 - M[assignment[clauses[:, 0]], assignment[clauses[:, 1]]]
+            if instance.weighted:
+                edge_conflicts[r] = edge_conflicts[r] * instance.clause_weights[r].reshape([-1, 1])
+            conflicts += np.sum(edge_conflicts[r][:, iterations - 1])
+
+        output = {'assignment': assignment,
+                  'conflicts': np.float32(conflicts),
+                  'conflict_ratio': conflicts / instance.n_clauses,
+                  'phi': phi,
+                  'edge_conflicts': edge_conflicts}
+        return output
+
+    def predict_boosted(self, instance, iterations, attempts, return_all=False):
+        """
+        Generate predictions with boosted performance by making multiple runs in parallel and using the best results.
+        :param instance: A CSP_Instance object.
+        :param iterations: The number of iterations that RUN-CSP performs on each instances.
+        :param attempts: The number of parallel runs.
+        :param return_all: If True, the assignments of all attempts and iterations are also returned as 'all_assignments'.
+        :return: The predictions for the run with the least conflicts
+        """
+        combined, scatter = self.replication_cache.get(instance, attempts, lambda: self.replicate(instance, attempts))
+        output_dict = self.predict(combined, iterations=iterations, scatter=scatter)
+
+        assignments = np.reshape(output_dict['assignment'], (attempts, instance.n_variables, iterations))
+
+        conf = np.zeros([attempts, iterations], np.float64 if instance.weighted else np.int64)
+        for r in instance.language.relation_names:
+            edge_conf = np.reshape(output_dict['edge_conflicts'][r], [attempts, len(instance.clauses[r]), iterations])
+            conf += np.sum(edge_conf, axis=1).astype(conf.dtype)
+
+        best = np.unravel_index(np.argmin(conf, axis=None), conf.shape)
+        best_assignment = assignments[best[0], :, best[1]]
+        best_conflicts = conf[best]
+
+        output = {'assignment': best_assignment,
+                  'conflicts': best_conflicts,
+                  'conflict_ratio': best_conflicts / instance.n_clauses,
+                  'best_attempt': best[0],
+                  'best_iteration': best[1],
+                  'all_conflicts': conf}
+        if return_all:
+            output['all_assignments'] = assignments
+        return output
+
+    @staticmethod
+    def load(model_dir, name='best'):
+        """
+        Loads a network from the model directory of a trained RUN_CSP network
+        :param model_dir: The directory
+        :param name: Name of the checkpoint
+        :return: The loaded NumPy_RUN_CSP network
+        """
+        with open(os.path.join(model_dir, "parameters.json"), 'r') as f:
+            parameters = json.load(f)
+
+        state_size = parameters['state_size']
+        language = Constraint_Language.load(os.path.join(model_dir, 'language.json'))
+
+        reader = Checkpoint_Reader(os.path.join(model_dir, f"model_{name}.ckpt"))
+        weights = {n: reader.get_tensor(n) for n in reader.variable_names() if n.startswith('rnn/') and 'Adam' not in n}
+
+        network = NumPy_RUN_CSP(language, weights, state_size)
+        return network
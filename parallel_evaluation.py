@@ -0,0 +1,104 @@
+import multiprocessing as mp
+import queue
+import time
+
+
+def worker(network_name, model_dir, threads, method, kwargs, tasks, results):
+    """
+    Worker process that loads a network once and solves instances until it receives None
+    :param network_name: The name of the network class in model.py, i.e. 'RUN_CSP' or 'Max_IS_Network'
+    :param model_dir: The model directory of the trained network
+    :param threads: Number of threads of the tensorflow session of this worker
+    :param method: The name of the prediction method that is called for each instance
+    :param kwargs: Additional keyword arguments for the prediction method
+    :param tasks: Queue of (index, instance) tuples
+    :param results: Queue to which (index, output_dict) tuples are sent
+    """
+    # tensorflow is only imported by the workers
+    import model
+
+    network = getattr(model, network_name).load(model_dir, threads=threads)
+    predict = getattr(network, method)
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        i, instance = task
+        output_dict = predict(instance, **kwargs)
+        results.put((i, output_dict))
+
+
+def evaluate_parallel(network_name, model_dir, instances, n_workers, threads=1, method='predict_boosted', max_pending=None, **kwargs):
+    """
+    Solves instances in parallel worker processes that each hold their own copy of the network
+    :param network_name: The name of the network class in model.py, i.e. 'RUN_CSP', 'Max_2SAT_Network' or 'Max_IS_Network'
+    :param model_dir: The model directory of the trained network
+    :param instances: A list or iterator of CSP instances. Instances are only drawn from it as the workers catch up.
+    :param n_workers: Number of worker processes
+    :param threads: Number of threads of the tensorflow session of each worker
+    :param method: The name of the prediction method, i.e. 'predict_boosted' or 'predict_boosted_and_corrected'
+    :param max_pending: Maximum number of instances that are sent to the workers ahead of the yielded results. Defaults to 2 * n_workers.
+    :param kwargs: Additional keyword arguments for the prediction method, i.e. iterations and attempts
+    :return: A generator that yields (instance, output_dict) tuples in the order of the given instances
+    """
+    if max_pending is None:
+        max_pending = 2 * n_workers
+
+    # tensorflow sessions are not fork safe
+    context = mp.get_context('spawn')
+    tasks = context.Queue()
+    results = context.Queue()
+
+    processes = [context.Process(target=worker, args=(network_name, model_dir, threads, method, kwargs, tasks, results))
+                 for _ in range(n_workers)]
+    for p in processes:
+        p.start()
+
+    start = time.time()
+    instances = iter(instances)
+    exhausted = False
+    finished = False
+    # instances that were sent to the workers and whose results were not yielded yet
+    submitted = {}
+    n_submitted = 0
+    try:
+        # buffer results that arrive out of order
+        pending = {}
+        i = 0
+        while True:
+            while not exhausted and len(submitted) < max_pending:
+                instance = next(instances, None)
+                if instance is None:
+                    exhausted = True
+                    for _ in range(n_workers):
+                        tasks.put(None)
+                else:
+                    tasks.put((n_submitted, instance))
+                    submitted[n_submitted] = instance
+                    n_submitted += 1
+
+            if exhausted and i == n_submitted:
+                break
+
+            while i not in pending:
+                try:
+                    j, output_dict = results.get(timeout=1.0)
+                except queue.Empty:
+                    if any(p.exitcode not in (None, 0) for p in processes):
+                        raise RuntimeError('An evaluation worker terminated unexpectedly')
+                    continue
+                pending[j] = output_dict
+            yield submitted.pop(i), pending.pop(i)
+            i += 1
+        finished = True
+    finally:
+        for p in processes:
+            if finished:
+                p.join()
+            else:
+                p.terminate()
+
+    # workers load their network before the first result arrives, so the throughput includes the loading time
+    duration = time.time() - start
+    print(f'Solved {n_submitted} instances with {n_workers} workers in {duration:.1f}s ({n_submitted / duration:.2f} instances/s)')
@@ -0,0 +1,166 @@
+from csp_utils import Constraint_Language, CSP_Instance
+
+import multiprocessing as mp
+import numpy as np
+import argparse
+import tempfile
+import shutil
+import time
+
+
+def worker(network_name, network_kwargs, threads, connection):
+    """
+    Worker process that computes gradients on the batches it receives until it receives None
+    :param network_name: The name of the network class in model.py, i.e. 'RUN_CSP' or 'Max_IS_Network'
+    :param network_kwargs: Keyword arguments for the constructor of the network, except for the model directory
+    :param threads: Number of threads of the tensorflow session of this worker
+    :param connection: Pipe connection that receives (weights, batch, iterations) tuples and sends (gradients, output_dict) tuples
+    """
+    # tensorflow is only imported by the workers
+    import model
+
+    # the weights of the worker are replaced in every step, so it only needs a temporary model directory
+    model_dir = tempfile.mkdtemp()
+    try:
+        network = getattr(model, network_name)(model_dir, threads=threads, **network_kwargs)
+        while True:
+            task = connection.recv()
+            if task is None:
+                break
+            weights, batch, iterations = task
+            network.set_weights(weights)
+            connection.send(network.compute_gradients(batch, iterations))
+    finally:
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+
+class Parallel_Trainer:
+    """
+    Synchronous data-parallel training. In each step, every worker process computes the clipped gradients on its own batch.
+    The gradients are averaged and applied to the network of the main process, whose weights are sent to the workers.
+    """
+
+    def __init__(self, network, network_name, network_kwargs, n_workers, threads=1):
+        """
+        :param network: The network that is trained, it holds the optimizer state and the checkpoints
+        :param network_name: The name of the network class in model.py, which the workers construct
+        :param network_kwargs: Keyword arguments for the constructor of the network, except for the model directory
+        :param n_workers: Number of worker processes
+        :param threads: Number of threads of the tensorflow session of each worker
+        """
+        self.network = network
+        self.n_workers = n_workers
+        self.step_count = None
+
+        # tensorflow sessions are not fork safe
+        context = mp.get_context('spawn')
+        self.connections = []
+        self.processes = []
+        for _ in range(n_workers):
+            parent, child = context.Pipe()
+            p = context.Process(target=worker, args=(network_name, network_kwargs, threads, child))
+            p.start()
+            self.connections.append(parent)
+            self.processes.append(p)
+
+    def step(self, batches, iterations):
+        """
+        Performs one synchronous training step
+        :param batches: A list of at most n_workers batches
+        :param iterations: The number of iterations that RUN-CSP performs on each batch
+        :return: A list with the output dict of each batch
+        """
+        weights = self.network.get_weights()
+        for connection, batch in zip(self.connections, batches):
+            connection.send((weights, batch, iterations))
+
+        results = [connection.recv() for connection in self.connections[:len(batches)]]
+        gradients = [np.mean(g, axis=0) for g in zip(*[r[0] for r in results])]
+        self.step_count = self.network.apply_gradients(gradients)
+        return [r[1] for r in results]
+
+    def train(self, batches, iterations, epoch=0):
+        """
+        Performs one training epoch, where each step processes n_workers consecutive batches
+        :param batches: A list of CSP instances, i.e. the output of CSP_Instance.batch_instances
+        :param iterations: The number of iterations that RUN-CSP performs on each batch
+        :param epoch: The current epoch, which is stored in periodic checkpoints
+        :return: A dictionary with the mean loss and ratio of conflicting clauses and the number of batches per second
+        """
+        batches = list(batches)
+        outputs = []
+        start = time.time()
+        for i in range(0, len(batches), self.n_workers):
+            outputs += self.step(batches[i:i + self.n_workers], iterations)
+            self.network.checkpoints.maybe_save(self.step_count, epoch)
+        duration = time.time() - start
+
+        output = {'conflict_ratio': np.mean([o['conflict_ratio'] for o in outputs]),
+                  'loss': np.mean([o['loss'] for o in outputs]),
+                  'batches_per_second': len(batches) / duration}
+        return output
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(None)
+        for p in self.processes:
+            p.join()
+
+
+def benchmark_scaling(network_name, network_kwargs, batches, iterations, worker_counts=(1, 2, 4, 8), threads=1):
+    """
+    Measures the training throughput of Parallel_Trainer for different numbers of workers on a temporary network
+    :param network_name: The name of the network class in model.py
+    :param network_kwargs: Keyword arguments for the constructor of the network, except for the model directory
+    :param batches: A list of training batches
+    :param iterations: The number of iterations that RUN-CSP performs on each batch
+    :param worker_counts: The numbers of workers to compare
+    :param threads: Number of threads of the tensorflow session of each worker
+    :return: A dict that maps each number of workers to its throughput in batches per second
+    """
+    import model
+
+    model_dir = tempfile.mkdtemp()
+    throughput = {}
+    try:
+        network = getattr(model, network_name)(model_dir, **network_kwargs)
+        for k in worker_counts:
+            trainer = Parallel_Trainer(network, network_name, network_kwargs, k, threads)
+            # the first step includes the construction of the worker networks
+            trainer.step(batches[:k], iterations)
+            throughput[k] = trainer.train(batches, iterations)['batches_per_second']
+            trainer.close()
+
+            # efficiency relative to perfect linear scaling of the smallest number of workers
+            k_0 = min(throughput.keys())
+            efficiency = (throughput[k] / throughput[k_0]) / (k / k_0)
+            print(f'{k} workers: {throughput[k]:.2f} batches/s, scaling efficiency {100 * efficiency:.0f}%')
+    finally:
+        shutil.rmtree(model_dir, ignore_errors=True)
+    return throughput
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-l', '--language_config_path', type=str, help='The path to a json file that specifies the constraint language')
+    parser.add_argument('-v', '--n_variables', type=int, default=100, help='Number of variables in each training instance.')
+    parser.add_argument('--c_min', type=int, default=100, help='Minimum number of clauses in each training instance.')
+    parser.add_argument('--c_max', type=int, default=600, help='Maximum number of clauses in each training instance.')
+    parser.add_argument('-n', '--n_batches', type=int, default=64, help='Number of batches that are processed for each number of workers.')
+    parser.add_argument('-t', '--t_max', type=int, default=30, help='Number of iterations t_max for which RUN-CSP runs on each instance')
+    parser.add_argument('-s', '--state_size', type=int, default=128, help='Size of the variable states in RUN-CSP')
+    parser.add_argument('-b', '--batch_size', type=int, default=10, help='Batch size used during training')
+    parser.add_argument('-w', '--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Numbers of worker processes to compare')
+    parser.add_argument('--threads', type=int, default=1, help='Number of tensorflow threads of each worker process.')
+    args = parser.parse_args()
+
+    language = Constraint_Language.load(args.language_config_path)
+    batches = [CSP_Instance.generate_random_batch(args.n_variables, np.random.randint(args.c_min, args.c_max, size=args.batch_size), language)
+               for _ in range(args.n_batches)]
+
+    network_kwargs = {'language': language, 'state_size': args.state_size}
+    benchmark_scaling('RUN_CSP', network_kwargs, batches, args.t_max, args.workers, args.threads)
+
+
+if __name__ == '__main__':
+    main()
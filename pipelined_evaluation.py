@@ -0,0 +1,99 @@
+import threading
+import queue
+import time
+
+
+def evaluate_pipelined(instances, prepare, run, finish, prefetch=2):
+    """
+    Evaluates a network as a three stage pipeline. A producer thread prepares the input of the next instance and
+    a consumer thread post-processes the previous output while the calling thread executes the network.
+    Tensorflow releases the GIL inside session.run, such that the host-side work overlaps with the network execution.
+    :param instances: A list or iterator of CSP instances
+    :param prepare: Function that maps an instance to its network input, i.e. the feed dict of the merged attempts
+    :param run: Function that maps an instance and its prepared input to an output dict by executing the network
+    :param finish: Function that maps an instance and its output dict to a result, i.e. by scoring and printing it
+    :param prefetch: Maximum number of prepared inputs and of unprocessed outputs that are buffered between the stages
+    :return: A list with the results of finish in the order of the instances
+    """
+    inputs = queue.Queue(prefetch)
+    outputs = queue.Queue(prefetch)
+    timings = {'prepare': 0.0, 'run': 0.0, 'finish': 0.0}
+    results = []
+    errors = []
+    # set when one of the stages fails, such that the others do not block forever
+    stop = threading.Event()
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def producer():
+        try:
+            for instance in instances:
+                start = time.time()
+                prepared = prepare(instance)
+                timings['prepare'] += time.time() - start
+                put(inputs, (instance, prepared))
+            put(inputs, None)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    def consumer():
+        try:
+            while True:
+                item = get(outputs)
+                if item is None:
+                    break
+                start = time.time()
+                results.append(finish(*item))
+                timings['finish'] += time.time() - start
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=producer, daemon=True), threading.Thread(target=consumer, daemon=True)]
+    start_time = time.time()
+    for t in threads:
+        t.start()
+
+    try:
+        while True:
+            item = get(inputs)
+            if item is None:
+                break
+            instance, prepared = item
+            start = time.time()
+            output_dict = run(instance, prepared)
+            timings['run'] += time.time() - start
+            put(outputs, (instance, output_dict))
+        put(outputs, None)
+        threads[1].join()
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+    if len(errors) > 0:
+        raise errors[0]
+
+    # the host-side time that was hidden behind the network execution
+    duration = time.time() - start_time
+    host = timings['prepare'] + timings['finish']
+    hidden = min(host, max(0.0, host + timings['run'] - duration))
+    print(f'Pipeline: preparation {timings["prepare"]:.1f}s, network {timings["run"]:.1f}s, post-processing {timings["finish"]:.1f}s, total {duration:.1f}s')
+    print(f'Overlap: {hidden:.1f}s of host work ({100 * hidden / max(host, 1e-9):.0f}%) ran concurrently with the network, '
+          f'which was busy {100 * timings["run"] / max(duration, 1e-9):.0f}% of the time')
+    return results
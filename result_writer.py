@@ -0,0 +1,78 @@
+import os
+import csv
+import json
+
+
+RESULT_FIELDS = ['name', 'conflicts', 'score', 'attempts', 't_max', 'best_iteration', 'time']
+
+
+class Result_Writer:
+    """
+    Appends one row per solved instance to a JSONL or CSV file and flushes it immediately.
+    Instances that are already recorded in an existing file can be skipped, such that interrupted runs can be resumed.
+    """
+
+    def __init__(self, path, fields=RESULT_FIELDS):
+        """
+        :param path: The result file. Files ending with .csv are written as CSV, all others as JSON lines.
+        :param fields: The columns of the CSV file
+        """
+        self.path = path
+        self.fields = fields
+        self.csv = path.endswith('.csv')
+
+        directory = os.path.dirname(path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+
+        self.done = set(str(row['name']) for row in self.read())
+
+        self.file = open(path, 'a', newline='')
+        if self.csv:
+            self.writer = csv.DictWriter(self.file, fieldnames=self.fields, extrasaction='ignore')
+            if self.file.tell() == 0:
+                self.writer.writeheader()
+                self.file.flush()
+
+    def read(self):
+        """ :return: A list of the complete rows in the file. An incomplete last row of a crashed run is removed. """
+        if not os.path.exists(self.path):
+            return []
+
+        # cut off a partially written last line
+        with open(self.path, 'rb+') as f:
+            content = f.read()
+            end = content.rfind(b'\n') + 1
+            if end < len(content):
+                f.truncate(end)
+
+        with open(self.path, 'r', newline='') as f:
+            if self.csv:
+                return [row for row in csv.DictReader(f)]
+            return [json.loads(line) for line in f if line.strip() != '']
+
+    def __contains__(self, name):
+        return str(name) in self.done
+
+    def write(self, row):
+        """ :param row: A dict with the results of one instance, which at least contains its name """
+        if self.csv:
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps({k: to_json(v) for k, v in row.items()}) + '\n')
+        self.file.flush()
+        self.done.add(str(row['name']))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def to_json(value):
+    """ Converts numpy scalars into python numbers """
+    return value.item() if hasattr(value, 'item') else value
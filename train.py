@@ -1,33 +1,54 @@
-from model import RUN_CSP
 from csp_utils import Constraint_Language, CSP_Instance
+from data_pipeline import Batch_Stream, random_batch, training_batches
+from parallel_training import Parallel_Trainer
 
 import argparse
+import functools
 import numpy as np
 from tqdm import tqdm
 
 
-def train(network, train_data, t_max, epochs):
+def train(network, train_data, t_max, epochs, resume=False, checkpoint_every=None, trainer=None, truncation=None):
     """
     Trains a RUN-CSP Network on the given data
     :param network: The RUN_CSP network
     :param train_data: A list of CSP instances that are used for training
     :param t_max: Number of RUN_CSP iterations on each instance
     :param epochs: Number of training epochs
+    :param resume: If True, training continues from the latest periodic checkpoint in the model directory
+    :param checkpoint_every: Optional number of training steps between periodic checkpoints within an epoch
+    :param trainer: Optional Parallel_Trainer that trains the network with multiple worker processes
+    :param truncation: Optional number of iterations per segment of truncated backpropagation through time
     """
+    network.checkpoints.save_every = checkpoint_every
 
     best_conflict_ratio = 1.0
-    for e in range(epochs):
+    start = 0
+    state = network.checkpoints.restore_latest() if resume else None
+    if state is not None:
+        # a checkpoint within an epoch restarts it with the restored weights, since its batch order is not reproducible
+        start = state['epoch']
+        if state.get('best_metric') is not None:
+            best_conflict_ratio = state['best_metric']
+
+    for e in range(start, epochs):
         print('Epoch: {}'.format(e))
 
         # train one epoch
-        output_dict = network.train(train_data, iterations=t_max)
+        if trainer is None:
+            output_dict = network.train(train_data, iterations=t_max, epoch=e, truncation=truncation)
+        else:
+            output_dict = trainer.train(train_data, iterations=t_max, epoch=e)
         conflict_ratio = output_dict['conflict_ratio']
         print(f'Ratio of violated constraints: {conflict_ratio}')
 
-        # if network improved, save new model
-        if conflict_ratio < best_conflict_ratio:
-            network.save_checkpoint('best')
+        # store a checkpoint in the background, which is also the best model if the network improved
+        improved = conflict_ratio < best_conflict_ratio
+        if improved:
             best_conflict_ratio = conflict_ratio
+        network.checkpoints.save_step(network.session.run(network.global_step), e + 1, conflict_ratio, best=improved)
+
+    network.checkpoints.wait()
 
 
 def main():
@@ -42,20 +63,54 @@ def main():
     parser.add_argument('-s', '--state_size', type=int, default=128, help='Size of the variable states in RUN-CSP')
     parser.add_argument('-b', '--batch_size', type=int, default=10, help='Batch size used during training')
     parser.add_argument('-e', '--epochs', type=int, default=25, help='Number of training epochs')
+    parser.add_argument('--stream', action='store_true', help='Sample fresh training batches in background processes instead of generating all instances up front')
+    parser.add_argument('-w', '--workers', type=int, default=2, help='Number of worker processes that generate batches. Only used with --stream.')
+    parser.add_argument('--parallel_workers', type=int, default=None, help='Number of worker processes for synchronous data-parallel training.')
+    parser.add_argument('--threads', type=int, default=1, help='Number of tensorflow threads of each training worker process.')
+    parser.add_argument('--resume', action='store_true', help='Continue training from the latest periodic checkpoint in the model directory.')
+    parser.add_argument('--checkpoint_every', type=int, default=None, help='Number of training steps between periodic checkpoints. Checkpoints are always stored after each epoch. Resuming from a checkpoint within an epoch restarts that epoch.')
+    parser.add_argument('--batch_clauses', type=int, default=None, help='Pack instances of similar size into batches of at most this many clauses instead of batch_size instances. Not used with --stream.')
+    parser.add_argument('--truncation', type=int, default=None, help='Backpropagate through segments of this many iterations instead of all t_max iterations to bound the training memory.')
     args = parser.parse_args()
 
     print(f'Loading constraint language from {args.language_config_path}')
     language = Constraint_Language.load(args.language_config_path)
+    # tensorflow is imported here, since the spawned batch workers re-import this module
+    from model import RUN_CSP
+
     # create RUN_CSP instance for given constraint language
     network = RUN_CSP(args.model_dir, language, args.state_size)
 
-    print(f'Generating {args.n_instances} training instances')
-    train_instances = [CSP_Instance.generate_random(args.n_variables, np.random.randint(args.c_min, args.c_max), language) for _ in tqdm(range(args.n_instances))]
-    # combine instances into batches
-    train_batches = CSP_Instance.batch_instances(train_instances, args.batch_size)
+    if args.stream:
+        # each epoch consists of the same number of freshly sampled batches
+        make_batch = functools.partial(random_batch, language=language, n_variables=args.n_variables,
+                                       c_min=args.c_min, c_max=args.c_max, batch_size=args.batch_size)
+        n_batches = int(np.ceil(args.n_instances / args.batch_size))
+        train_batches = Batch_Stream(make_batch, n_batches=n_batches, n_workers=args.workers)
+    else:
+        print(f'Generating {args.n_instances} training instances')
+        if args.batch_clauses is None:
+            # sample the instances of each batch directly as one merged instance
+            batch_sizes = [min(args.batch_size, args.n_instances - i) for i in range(0, args.n_instances, args.batch_size)]
+            train_batches = [CSP_Instance.generate_random_batch(args.n_variables, np.random.randint(args.c_min, args.c_max, size=b), language) for b in tqdm(batch_sizes)]
+        else:
+            # batches of instances with similar size are drawn anew in each epoch
+            instances = [CSP_Instance.generate_random(args.n_variables, c, language) for c in tqdm(np.random.randint(args.c_min, args.c_max, size=args.n_instances))]
+            train_batches = training_batches(instances, args.batch_size, args.batch_clauses)
 
     # train and store the network
-    train(network, train_batches, args.t_max, args.epochs)
+    trainer = None
+    if args.parallel_workers is not None:
+        if args.truncation is not None:
+            parser.error('--truncation is not supported with --parallel_workers')
+        trainer = Parallel_Trainer(network, 'RUN_CSP', {'language': language, 'state_size': args.state_size}, args.parallel_workers, args.threads)
+    train(network, train_batches, args.t_max, args.epochs, resume=args.resume, checkpoint_every=args.checkpoint_every, trainer=trainer, truncation=args.truncation)
+
+    if trainer is not None:
+        trainer.close()
+
+    if args.stream:
+        train_batches.close()
 
 
 if __name__ == '__main__':
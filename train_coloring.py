@@ -1,5 +1,6 @@
 from model import RUN_CSP
-from csp_utils import CSP_Instance, Constraint_Language
+from csp_utils import Constraint_Language
+from data_pipeline import training_batches
 from train import train
 
 import data_utils
@@ -21,22 +22,26 @@ def main():
     parser.add_argument('-m', '--model_dir', type=str, help='Model directory in which the trained model is stored')
     parser.add_argument('-d', '--data_path', help='A path to a training set of graphs in the dimacs graph format.')
     parser.add_argument('--n_colors', type=int, default=3, help='Number of colors')
+    parser.add_argument('--load_workers', type=int, default=None, help='Number of worker processes that parse the data files in parallel.')
+    parser.add_argument('--resume', action='store_true', help='Continue training from the latest periodic checkpoint in the model directory.')
+    parser.add_argument('--checkpoint_every', type=int, default=None, help='Number of training steps between periodic checkpoints. Checkpoints are always stored after each epoch.')
+    parser.add_argument('--truncation', type=int, default=None, help='Backpropagate through segments of this many iterations instead of all t_max iterations to bound the training memory.')
+    parser.add_argument('--batch_clauses', type=int, default=None, help='Pack instances of similar size into batches of at most this many clauses instead of batch_size instances.')
+    parser.add_argument('--batch_variables', type=int, default=None, help='Maximum number of variables in each batch. Replaces batch_size like --batch_clauses.')
     args = parser.parse_args()
 
     language = Constraint_Language.get_coloring_language(args.n_colors)
 
     print('loading graphs...')
-    names, graphs = data_utils.load_graphs(args.data_path)
-    random.shuffle(graphs)
-    print('Converting graphs to CSP Instances')
-    instances = [CSP_Instance.graph_to_csp_instance(g, language, 'NEQ') for g in tqdm(graphs)]
+    instances = data_utils.load_graph_instances(args.data_path, language, 'NEQ', n_workers=args.load_workers)
+    random.shuffle(instances)
     
     # combine instances into batches
-    train_batches = CSP_Instance.batch_instances(instances, args.batch_size)
+    train_batches = training_batches(instances, args.batch_size, args.batch_clauses, args.batch_variables)
 
     # construct and train new network
     network = RUN_CSP(args.model_dir, language)
-    train(network, train_batches, epochs=args.epochs, t_max=args.t_max)
+    train(network, train_batches, epochs=args.epochs, t_max=args.t_max, resume=args.resume, checkpoint_every=args.checkpoint_every, truncation=args.truncation)
 
 
 if __name__ == '__main__':
@@ -1,5 +1,6 @@
 from model import Max_2SAT_Network
-from csp_utils import CSP_Instance, max_2sat_language
+from csp_utils import max_2sat_language
+from data_pipeline import training_batches
 from train import train
 
 import data_utils
@@ -18,20 +19,24 @@ def main():
     parser.add_argument('-b', '--batch_size', type=int, default=10, help='Batch size for training')
     parser.add_argument('-m', '--model_dir', type=str, help='Model directory in which the trained model is stored')
     parser.add_argument('-d', '--data_path', help='A path to a training set of formulas in the DIMACS cnf format.')
+    parser.add_argument('--load_workers', type=int, default=None, help='Number of worker processes that parse the data files in parallel.')
+    parser.add_argument('--resume', action='store_true', help='Continue training from the latest periodic checkpoint in the model directory.')
+    parser.add_argument('--checkpoint_every', type=int, default=None, help='Number of training steps between periodic checkpoints. Checkpoints are always stored after each epoch.')
+    parser.add_argument('--truncation', type=int, default=None, help='Backpropagate through segments of this many iterations instead of all t_max iterations to bound the training memory.')
+    parser.add_argument('--batch_clauses', type=int, default=None, help='Pack instances of similar size into batches of at most this many clauses instead of batch_size instances.')
+    parser.add_argument('--batch_variables', type=int, default=None, help='Maximum number of variables in each batch. Replaces batch_size like --batch_clauses.')
     args = parser.parse_args()
 
     print('loading cnf formulas...')
-    names, formulas = data_utils.load_formulas(args.data_path)
-    random.shuffle(formulas)
-    print('Converting formulas to CSP instances')
-    instances = [CSP_Instance.cnf_to_instance(f) for f in formulas]
+    instances = data_utils.load_formula_instances(args.data_path, n_workers=args.load_workers)
+    random.shuffle(instances)
         
     # combine instances into batches
-    train_batches = CSP_Instance.batch_instances(instances, args.batch_size)
+    train_batches = training_batches(instances, args.batch_size, args.batch_clauses, args.batch_variables)
 
     # construct and train new network
     network = Max_2SAT_Network(args.model_dir, state_size=args.state_size)
-    train(network, train_batches, t_max=args.t_max, epochs=args.epochs)
+    train(network, train_batches, t_max=args.t_max, epochs=args.epochs, resume=args.resume, checkpoint_every=args.checkpoint_every, truncation=args.truncation)
 
 
 if __name__ == '__main__':
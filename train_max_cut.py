@@ -1,6 +1,7 @@
 from model import RUN_CSP
 from train import train
-from csp_utils import CSP_Instance, Constraint_Language
+from csp_utils import Constraint_Language
+from data_pipeline import training_batches
 
 import data_utils
 import argparse
@@ -22,17 +23,22 @@ def main():
     parser.add_argument('-m', '--model_dir', type=str, help='The model directory of a trained network')
     parser.add_argument('-t', '--t_max', type=int, default=30, help='Number of iterations t_max for which RUN-CSP runs on each instance')
     parser.add_argument('-d', '--data_path', help='A path to a training set of graphs in the dimacs graph format')
+    parser.add_argument('--load_workers', type=int, default=None, help='Number of worker processes that parse the data files in parallel.')
+    parser.add_argument('--resume', action='store_true', help='Continue training from the latest periodic checkpoint in the model directory.')
+    parser.add_argument('--checkpoint_every', type=int, default=None, help='Number of training steps between periodic checkpoints. Checkpoints are always stored after each epoch.')
+    parser.add_argument('--truncation', type=int, default=None, help='Backpropagate through segments of this many iterations instead of all t_max iterations to bound the training memory.')
+    parser.add_argument('--batch_clauses', type=int, default=None, help='Pack instances of similar size into batches of at most this many clauses instead of batch_size instances.')
+    parser.add_argument('--batch_variables', type=int, default=None, help='Maximum number of variables in each batch. Replaces batch_size like --batch_clauses.')
     args = parser.parse_args()
 
     language = Constraint_Language.get_coloring_language(2)
 
     print('loading graphs...')
-    names, graphs = data_utils.load_graphs(args.data_path)
-    instances = [CSP_Instance.graph_to_csp_instance(g, language, 'NEQ') for g in graphs]
+    instances = data_utils.load_graph_instances(args.data_path, language, 'NEQ', n_workers=args.load_workers)
 
-    train_batches = CSP_Instance.batch_instances(instances, args.batch_size)
+    train_batches = training_batches(instances, args.batch_size, args.batch_clauses, args.batch_variables)
     network = RUN_CSP(args.model_dir, language=language, state_size=args.state_size)
-    train(network, train_batches, t_max=args.t_max, epochs=args.epochs)
+    train(network, train_batches, t_max=args.t_max, epochs=args.epochs, resume=args.resume, checkpoint_every=args.checkpoint_every, truncation=args.truncation)
 
 
 if __name__ == '__main__':
@@ -1,5 +1,6 @@
 from model import Max_IS_Network
-from csp_utils import CSP_Instance, is_language
+from csp_utils import is_language
+from data_pipeline import training_batches
 
 import data_utils
 import argparse
@@ -8,21 +9,33 @@ import random
 from tqdm import tqdm
 
 
-def train(network, train_data, t_max, epochs):
+def train(network, train_data, t_max, epochs, resume=False, checkpoint_every=None, truncation=None):
     '''
     Trains an Independent Set Network on the given data
     :param network: The Max_IS_Network instance
     :param train_data: A list of CSP instances that are used for training
     :param t_max: Number of RUN_CSP iterations on each instance
     :param epochs: Number of training epochs
+    :param resume: If True, training continues from the latest periodic checkpoint in the model directory
+    :param checkpoint_every: Optional number of training steps between periodic checkpoints within an epoch
+    :param truncation: Optional number of iterations per segment of truncated backpropagation through time
     '''
+    network.checkpoints.save_every = checkpoint_every
 
     best_ratio = 0.0
-    for e in range(epochs):
+    start = 0
+    state = network.checkpoints.restore_latest() if resume else None
+    if state is not None:
+        # a checkpoint within an epoch restarts it with the restored weights, since its batch order is not reproducible
+        start = state['epoch']
+        if state.get('best_metric') is not None:
+            best_ratio = state['best_metric']
+
+    for e in range(start, epochs):
         print('Epoch: {}'.format(e))
 
         # train one epoch
-        output_dict = network.train(train_data, iterations=t_max)
+        output_dict = network.train(train_data, iterations=t_max, epoch=e, truncation=truncation)
 
         # Get average percentage of conflicting edges and relative size of independent set
         conflict_ratio = output_dict['conflict_ratio']
@@ -30,11 +43,14 @@ def train(network, train_data, t_max, epochs):
         corrected_ratio = output_dict['corrected_ratio']
         print(f'Ratio of violated constraints: {conflict_ratio}, IS Ratio: {is_ratio}, Corrected: {corrected_ratio}')
 
-        # if network improved, save new model
-        if corrected_ratio > best_ratio:
-            network.save_checkpoint('best')
+        # store a checkpoint in the background, which is also the best model if the network improved
+        improved = corrected_ratio > best_ratio
+        if improved:
             best_ratio = corrected_ratio
-            
+        network.checkpoints.save_step(network.session.run(network.global_step), e + 1, corrected_ratio, best=improved)
+
+    network.checkpoints.wait()
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -45,20 +61,24 @@ def main():
     parser.add_argument('-b', '--batch_size', type=int, default=10, help='Batch size for training')
     parser.add_argument('-m', '--model_dir', type=str, help='Model directory in which the trained model is stored')
     parser.add_argument('-d', '--data_path', help='A path to a training set of graphs in the dimacs format.')
+    parser.add_argument('--load_workers', type=int, default=None, help='Number of worker processes that parse the data files in parallel.')
+    parser.add_argument('--resume', action='store_true', help='Continue training from the latest periodic checkpoint in the model directory.')
+    parser.add_argument('--checkpoint_every', type=int, default=None, help='Number of training steps between periodic checkpoints. Checkpoints are always stored after each epoch. Resuming from a checkpoint within an epoch restarts that epoch.')
+    parser.add_argument('--truncation', type=int, default=None, help='Backpropagate through segments of this many iterations instead of all t_max iterations to bound the training memory.')
+    parser.add_argument('--batch_clauses', type=int, default=None, help='Pack instances of similar size into batches of at most this many clauses instead of batch_size instances.')
+    parser.add_argument('--batch_variables', type=int, default=None, help='Maximum number of variables in each batch. Replaces batch_size like --batch_clauses.')
     args = parser.parse_args()
  
     print('loading graphs...')
-    names, graphs = data_utils.load_graphs(args.data_path)
-    random.shuffle(graphs)
-    print('Converting graphs to CSP Instances')
-    instances = [CSP_Instance.graph_to_csp_instance(g, is_language, 'NAND') for g in graphs]
+    instances = data_utils.load_graph_instances(args.data_path, is_language, 'NAND', n_workers=args.load_workers)
+    random.shuffle(instances)
     
     # combine instances into batches
-    train_batches = CSP_Instance.batch_instances(instances, args.batch_size)
+    train_batches = training_batches(instances, args.batch_size, args.batch_clauses, args.batch_variables)
 
     # construct new network
     network = Max_IS_Network(args.model_dir, state_size=args.state_size)
-    train(network, train_batches, t_max=args.t_max, epochs=args.epochs)
+    train(network, train_batches, t_max=args.t_max, epochs=args.epochs, resume=args.resume, checkpoint_every=args.checkpoint_every, truncation=args.truncation)
 
 
 if __name__ == '__main__':
@@ -1,6 +1,7 @@
 from model import RUN_CSP
 from train import train
 from csp_utils import CSP_Instance, mc_weighted_language
+from data_pipeline import training_batches
 
 import data_utils
 import argparse
@@ -32,6 +33,11 @@ def main():
     parser.add_argument('-i', '--n_instances', type=int, default=400,
                         help='Number of instances for training.')
     parser.add_argument('-s', '--save_path', type=str, help='Path to a csv file to store results')
+    parser.add_argument('--resume', action='store_true', help='Continue training from the latest periodic checkpoint in the model directory.')
+    parser.add_argument('--checkpoint_every', type=int, default=None, help='Number of training steps between periodic checkpoints. Checkpoints are always stored after each epoch.')
+    parser.add_argument('--truncation', type=int, default=None, help='Backpropagate through segments of this many iterations instead of all t_max iterations to bound the training memory.')
+    parser.add_argument('--batch_clauses', type=int, default=None, help='Pack instances of similar size into batches of at most this many clauses instead of batch_size instances.')
+    parser.add_argument('--batch_variables', type=int, default=None, help='Maximum number of variables in each batch. Replaces batch_size like --batch_clauses.')
     args = parser.parse_args()
 
     language = mc_weighted_language
@@ -40,9 +46,9 @@ def main():
     graphs = [get_random_graph() for _ in range(args.n_instances)]
     instances = [CSP_Instance.graph_to_weighted_mc_instance(g) for g in tqdm(graphs)]
 
-    train_batches = CSP_Instance.batch_instances(instances, args.batch_size)
+    train_batches = training_batches(instances, args.batch_size, args.batch_clauses, args.batch_variables)
     net = RUN_CSP(args.model_dir, language=language)
-    train(net, train_batches, t_max=args.t_max, epochs=args.epochs)
+    train(net, train_batches, t_max=args.t_max, epochs=args.epochs, resume=args.resume, checkpoint_every=args.checkpoint_every, truncation=args.truncation)
 
 
 if __name__ == '__main__':